@@ -1,9 +1,116 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, Response, jsonify, session, make_response, g
 from datetime import date
+import functools
+import psycopg2
 import db_requests  
+from config import settings
+import exports
+import importer
+import jobs
+import parallel
+import scheduling
+import compression
+from db_conn import db, PoolTimeout
+from instrumentation import metrics
+import prepared
+from versions import versions
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_super_secret_key_for_sessions'  
+compression.init_app(app)
+
+@app.before_request
+def _begin_db_metrics():
+    metrics.begin_request()
+
+@app.before_request
+def _refresh_table_versions():
+    # изменения из других процессов сбрасывают здешние кэши не позже чем через TABLE_VERSIONS_INTERVAL;
+    # для conditional-представлений версии читаются заново, и их снимок переиспользует декоратор
+    g.table_versions = None
+    if request.endpoint in ('static', 'prometheus_metrics'):
+        return
+    view = app.view_functions.get(request.endpoint)
+    fresh = request.method == 'GET' and getattr(view, 'conditional_tables', None) is not None
+    try:
+        g.table_versions = versions.refresh(force=fresh)
+    except (psycopg2.Error, PoolTimeout):
+        # без версий страницы отдаются как обычно, только без ETag
+        app.logger.warning('could not read table versions', exc_info=True)
+
+@app.after_request
+def _end_db_metrics(response):
+    queries, db_time = metrics.end_request(request.endpoint or 'unknown')
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers['X-DB-Time'] = f'{db_time * 1000:.1f}ms'
+    return response
+
+def _list_page(fetch_page):
+    """
+    Fetches one keyset page using the after/before/limit query arguments.
+    """
+    try:
+        return fetch_page(
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            limit=request.args.get('limit', type=int)
+        )
+    except ValueError:
+        abort(400)
+
+def conditional(*tables):
+    """
+    Conditional GET for views built from `tables`: responses carry an ETag
+    and Last-Modified derived from the table versions, and a client whose
+    copy is still current gets 304 Not Modified without the view running.
+    The versions are read once per request, in before_request; when they
+    cannot be read the view runs without validators. A client
+    that sends only If-Modified-Since gets 304 only when the last change
+    happened in an earlier second than that date, since the header has no
+    finer resolution. Skipped while flash messages are pending so they are
+    not swallowed.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            snapshot = g.get('table_versions')
+            if request.method != 'GET' or session.get('_flashes') or snapshot is None:
+                return view(*args, **kwargs)
+
+            etag = versions.etag(snapshot, tables, request.full_path)
+            last_modified = versions.last_modified(snapshot, tables)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (request.if_modified_since is not None and last_modified is not None
+                                and last_modified < request.if_modified_since)
+
+            response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                # кэшировать можно, но каждый раз с перепроверкой
+                response.cache_control.no_cache = True
+            return response
+        wrapper.conditional_tables = tables
+        return wrapper
+    return decorator
+
+def _flash_batch_delete(result):
+    """
+    Reports a db_requests.delete_* batch result: what was deleted, which rows
+    are still referenced (and from where) and which ids were not found.
+    """
+    if result.deleted:
+        flash(f'Удалено записей: {len(result.deleted)}.', 'success')
+    if result.blocked:
+        blocked = '; '.join(f'"{row[2]}" ({", ".join(tables)})' for row, tables in result.blocked.values())
+        flash(f'Не удалены из-за связанных записей: {blocked}.', 'error')
+    if result.missing:
+        flash(f'Не найдены записи с id: {", ".join(map(str, result.missing))}.', 'error')
+    if not (result.deleted or result.blocked or result.missing):
+        flash('Не выбрано ни одной записи.', 'error')
 
 # --- Main Page & Dashboard ---
 @app.route('/')
@@ -12,12 +119,7 @@ def index():
     Displays the main dashboard with statistics.
     """
     try:
-        stats = {
-            'organizations_count': len(db_requests.get_all_organizations()),
-            'courses_count': len(db_requests.get_all_courses()),
-            'teachers_count': len(db_requests.get_all_teachers()),
-            'requests_count': len(db_requests.get_all_training_requests())
-        }
+        stats = db_requests.get_dashboard_stats()
     except Exception as e:
         flash(f'Could not load statistics from the database: {e}', 'error')
         stats = {'organizations_count': 0, 'courses_count': 0, 'teachers_count': 0, 'requests_count': 0}
@@ -25,12 +127,13 @@ def index():
 
 # --- Organizations ---
 @app.route('/organizations')
+@conditional('organizations')
 def organizations():
     """
-    Displays a list of all organizations.
+    Displays a page of organizations.
     """
-    all_orgs = db_requests.get_all_organizations()
-    return render_template('organizations.html', organizations=all_orgs)
+    page = _list_page(db_requests.get_organizations_page)
+    return render_template('organizations.html', organizations=page.rows, page=page)
 
 @app.route('/organizations/add', methods=['GET', 'POST'])
 def add_organization():
@@ -87,14 +190,23 @@ def delete_organization(org_id):
         flash('Could not delete organization. It might have associated courses.', 'error')
     return redirect(url_for('organizations'))
 
+@app.route('/organizations/delete', methods=['POST'])
+def delete_organizations():
+    """
+    Deletes the selected organizations that have no dependent records.
+    """
+    _flash_batch_delete(db_requests.delete_organizations(request.form.getlist('ids', type=int)))
+    return redirect(url_for('organizations'))
+
 # --- Courses ---
 @app.route('/courses')
+@conditional('courses', 'organizations')
 def courses():
     """
-    Displays a list of all courses.
+    Displays a page of courses.
     """
-    all_courses = db_requests.get_all_courses()
-    return render_template('courses.html', courses=all_courses)
+    page = _list_page(db_requests.get_courses_page)
+    return render_template('courses.html', courses=page.rows, page=page)
 
 @app.route('/courses/add', methods=['GET', 'POST'])
 def add_course():
@@ -147,9 +259,10 @@ def edit_course(course_id):
             flash(f'Error updating course: {e}', 'error')
         return redirect(url_for('courses'))
 
-    course = db_requests.get_course_by_id(course_id)
+    course, organizations_list = parallel.run(
+        functools.partial(db_requests.get_course_by_id, course_id),
+        db_requests.get_all_organizations)
     course_types = [(1, 'Professional Retraining'), (2, 'Advanced Training')]  # Placeholder
-    organizations_list = db_requests.get_all_organizations()
     return render_template('course_form.html', course=course, course_types=course_types, organizations=organizations_list)
 
 @app.route('/courses/delete/<int:course_id>')
@@ -164,6 +277,14 @@ def delete_course(course_id):
         flash('Could not delete course. Check for dependencies like requests, assignments, or prices.', 'error')
     return redirect(url_for('courses'))
 
+@app.route('/courses/delete', methods=['POST'])
+def delete_courses():
+    """
+    Deletes the selected courses that have no dependent records.
+    """
+    _flash_batch_delete(db_requests.delete_courses(request.form.getlist('ids', type=int)))
+    return redirect(url_for('courses'))
+
 @app.route('/courses/<int:course_id>/add-price', methods=['GET', 'POST'])
 def add_course_price(course_id):
     """
@@ -182,9 +303,10 @@ def add_course_price(course_id):
             flash(f'Ошибка при обновлении стоимости: {e}', 'error')
         return redirect(url_for('courses'))
     
-    course = db_requests.get_course_by_id(course_id)
-    # Получить текущую цену курса, если есть
-    current_price = db_requests.get_current_price(course_id)
+    # Получить курс и его текущую цену, если есть
+    course, current_price = parallel.run(
+        functools.partial(db_requests.get_course_by_id, course_id),
+        functools.partial(db_requests.get_current_price, course_id))
     return render_template('course_price_form.html', 
                           course=course, 
                           current_price=current_price,
@@ -192,9 +314,10 @@ def add_course_price(course_id):
 
 # --- Teachers ---
 @app.route('/teachers')
+@conditional('teachers')
 def teachers():
-    all_teachers = db_requests.get_all_teachers()
-    return render_template('teachers.html', teachers=all_teachers)
+    page = _list_page(db_requests.get_teachers_page)
+    return render_template('teachers.html', teachers=page.rows, page=page)
 
 @app.route('/teachers/add', methods=['GET', 'POST'])
 def add_teacher():
@@ -253,11 +376,20 @@ def delete_teacher(teacher_id):
         flash('Не удалось удалить преподавателя. Возможно, есть связанные записи.', 'error')
     return redirect(url_for('teachers'))
 
+@app.route('/teachers/delete', methods=['POST'])
+def delete_teachers():
+    """
+    Deletes the selected teachers that have no dependent records.
+    """
+    _flash_batch_delete(db_requests.delete_teachers(request.form.getlist('ids', type=int)))
+    return redirect(url_for('teachers'))
+
 # --- Training Requests ---
 @app.route('/training-requests')
+@conditional('training_requests', 'client_organizations', 'courses')
 def training_requests():
-    all_requests = db_requests.get_all_training_requests()
-    return render_template('training_requests.html', requests=all_requests)
+    page = _list_page(db_requests.get_training_requests_page)
+    return render_template('training_requests.html', requests=page.rows, page=page)
 
 @app.route('/training-requests/add', methods=['GET', 'POST'])
 def add_training_request():
@@ -272,6 +404,8 @@ def add_training_request():
                 course_id=request.form['course_id'],
                 required_deadline=request.form['required_deadline'],
                 total_students=request.form['total_students'],
+                start_date=request.form.get('start_date') or None,
+                end_date=request.form.get('end_date') or None,
                 status=request.form['status'],
             )
             flash('Заявка на обучение добавлена успешно!', 'success')
@@ -279,12 +413,36 @@ def add_training_request():
             flash(f'Ошибка при добавлении заявки: {e}', 'error')
         return redirect(url_for('training_requests'))
     
-    client_organizations = db_requests.get_all_organizations()
-    courses = db_requests.get_all_courses()
+    client_organizations, courses = parallel.run(db_requests.get_all_organizations,
+                                                 db_requests.get_all_courses)
     return render_template('training_request_form.html', 
                           client_organizations=client_organizations, 
                           courses=courses)
 
+@app.route('/training-requests/import', methods=['GET', 'POST'])
+def import_training_requests():
+    """
+    Handles bulk upload of training requests from a CSV file.
+    """
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Выберите CSV-файл для загрузки.', 'error')
+            return redirect(url_for('import_training_requests'))
+        try:
+            report = importer.import_training_requests(
+                importer.open_upload(upload.stream),
+                strict='strict' in request.form
+            )
+            flash(f'Загружено заявок: {report.imported} из {report.total_rows}.',
+                  'success' if not report.errors else 'error')
+        except Exception as e:
+            flash(f'Ошибка при загрузке заявок: {e}', 'error')
+    return render_template('training_request_import.html',
+                           report=report,
+                           columns=importer.REQUIRED_COLUMNS + importer.OPTIONAL_COLUMNS)
+
 @app.route('/training-requests/edit/<int:request_id>', methods=['GET', 'POST'])
 def edit_training_request(request_id):
     """
@@ -306,9 +464,10 @@ def edit_training_request(request_id):
             flash(f'Ошибка при обновлении заявки: {e}', 'error')
         return redirect(url_for('training_requests'))
     
-    req = db_requests.get_training_request_by_id(request_id)
-    client_organizations = db_requests.get_all_organizations()
-    courses = db_requests.get_all_courses()
+    req, client_organizations, courses = parallel.run(
+        functools.partial(db_requests.get_training_request_by_id, request_id),
+        db_requests.get_all_organizations,
+        db_requests.get_all_courses)
     return render_template('training_request_form.html', 
                           request=req,
                           client_organizations=client_organizations, 
@@ -316,16 +475,18 @@ def edit_training_request(request_id):
 
 # --- Reports ---
 @app.route('/reports/price-list', methods=['GET', 'POST'])
+@conditional('organizations', 'courses', 'price_documents')
 def price_list_report():
     """
     Handles the form for and display of the organization price list report.
     """
-    if request.method == 'POST':
-        org_id = request.form['organization_id']
-        target_date = request.form['target_date']
+    if 'organization_id' in request.values:
+        org_id = request.values['organization_id']
+        target_date = request.values['target_date']
         
-        organization = db_requests.get_organization_by_id(org_id)
-        price_list_data = db_requests.get_organization_price_list(org_id, target_date)
+        organization, price_list_data = parallel.run(
+            functools.partial(db_requests.get_organization_by_id, org_id),
+            functools.partial(db_requests.get_organization_price_list, org_id, target_date))
         
         return render_template('price_list_report.html', 
                                organization=organization, 
@@ -335,49 +496,273 @@ def price_list_report():
     organizations_list = db_requests.get_all_organizations()
     return render_template('price_list_form.html', organizations=organizations_list, today=date.today().isoformat())
 
+def _group_filling_data(course_id, start_date, end_date, progress=None):
+    periods = [(start_date, end_date)] if progress is None else \
+        jobs.split_period(start_date, end_date, settings.JOB_CHUNK_DAYS)
+    filling_data = None
+    for done, (period_start, period_end) in enumerate(periods):
+        if progress is not None:
+            progress(done, len(periods))
+        part = db_requests.get_course_group_filling(course_id, period_start, period_end)
+        if part is None:
+            break
+        if filling_data is None:
+            filling_data = dict(part, group_details=list(part['group_details']))
+            continue
+        for key in ('total_groups', 'total_students', 'full_groups', 'not_full_groups'):
+            filling_data[key] += part[key]
+        filling_data['group_details'].extend(part['group_details'])
+    if progress is not None:
+        progress(len(periods), len(periods))
+    return filling_data
+
+# без progress это один запрос из кэша отчетов - parallel.run вызовет его на месте
+_group_filling_data.is_cached = lambda course_id, start_date, end_date, progress=None: \
+    progress is None and db_requests.get_course_group_filling.is_cached(course_id, start_date, end_date)
+
+def _group_filling_result(course_id, start_date, end_date, progress=None):
+    """
+    Template context of the group filling report. With `progress` (a job)
+    the period is read in JOB_CHUNK_DAYS pieces and progress is reported.
+    """
+    # курс читается параллельно с отчетом
+    filling_data, course = parallel.run(
+        functools.partial(_group_filling_data, course_id, start_date, end_date, progress),
+        functools.partial(db_requests.get_course_by_id, course_id))
+    return {
+        'course': course,
+        'start_date': start_date,
+        'end_date': end_date,
+        'filling_data': filling_data,
+    }
+
 @app.route('/reports/group-filling', methods=['GET', 'POST'])
+@conditional('courses', 'training_requests')
 def group_filling_report():
     """
     Handles the form for and display of the group filling report.
     """
-    if request.method == 'POST':
-        course_id = request.form['course_id']
-        start_date = request.form['start_date']
-        end_date = request.form['end_date']
-
-        course = db_requests.get_course_by_id(course_id)
-        filling_data = db_requests.get_course_group_filling(course_id, start_date, end_date)
-        
-        return render_template('group_filling_report.html', 
-                               course=course, 
-                               start_date=start_date, 
-                               end_date=end_date, 
-                               filling_data=filling_data)
+    if 'course_id' in request.values:
+        return render_template('group_filling_report.html', **_group_filling_result(
+            request.values['course_id'], request.values['start_date'], request.values['end_date']))
 
     courses_list = db_requests.get_all_courses()
     return render_template('group_filling_form.html', courses=courses_list)
 
+def _teacher_schedule_lessons(teacher_ids, start_date, end_date, progress=None):
+    periods = [(start_date, end_date)] if progress is None else \
+        jobs.split_period(start_date, end_date, settings.JOB_CHUNK_DAYS)
+    lessons = []
+    for done, (period_start, period_end) in enumerate(periods):
+        if progress is not None:
+            progress(done, len(periods))
+        lessons.extend(db_requests.get_teachers_schedule(teacher_ids, period_start, period_end))
+    if len(periods) > 1:
+        # куски идут по датам; устойчивая сортировка возвращает порядок запроса
+        lessons.sort(key=lambda lesson: (lesson.teacher_name, lesson.teacher_id))
+    if progress is not None:
+        progress(len(periods), len(periods))
+    return lessons
+
+_teacher_schedule_lessons.is_cached = lambda teacher_ids, start_date, end_date, progress=None: \
+    progress is None and db_requests.get_teachers_schedule.is_cached(teacher_ids, start_date, end_date)
+
+def _teacher_schedule_result(teacher_ids, start_date, end_date, progress=None):
+    """
+    Template context of the teacher schedule report; chunked like
+    _group_filling_result when run as a job.
+    """
+    lessons, teachers, summary = parallel.run(
+        functools.partial(_teacher_schedule_lessons, teacher_ids, start_date, end_date, progress),
+        functools.partial(db_requests.get_teachers_by_ids, teacher_ids),
+        functools.partial(db_requests.get_teachers_lessons_summary, teacher_ids, start_date, end_date))
+
+    report = scheduling.build_schedule_report(lessons)
+    return {
+        'teachers': teachers,
+        'start_date': start_date,
+        'end_date': end_date,
+        'schedule': report['lessons'],
+        'summary': summary,
+        'conflicts': report['conflicts'],
+        'conflicting': report['conflicting'],
+    }
+
 @app.route('/reports/teacher-schedule', methods=['GET', 'POST'])
+@conditional('teachers', 'courses', 'teacher_assignments', 'schedule')
 def teacher_schedule_report():
     """
     Handles the form for and display of the teacher schedule report.
     """
-    if request.method == 'POST':
-        teacher_id = request.form['teacher_id']
-        start_date = request.form['start_date']
-        end_date = request.form['end_date']
-
-        teacher = db_requests.get_teacher_by_id(teacher_id)
-        schedule_data = db_requests.get_teacher_schedule(teacher_id, start_date, end_date)
-
-        return render_template('teacher_schedule_report.html',
-                               teacher=teacher,
-                               start_date=start_date,
-                               end_date=end_date,
-                               schedule=schedule_data)
+    if 'teacher_id' in request.values:
+        teacher_ids = request.values.getlist('teacher_id')
+        if not teacher_ids:
+            abort(400)
+        return render_template('teacher_schedule_report.html', **_teacher_schedule_result(
+            teacher_ids, request.values['start_date'], request.values['end_date']))
 
     teachers_list = db_requests.get_all_teachers()
     return render_template('teacher_schedule_form.html', teachers=teachers_list)
 
+# --- Background reports ---
+REPORT_JOBS = {
+    # kind: (построитель контекста, шаблон, форма)
+    'group_filling': (_group_filling_result, 'group_filling_report.html', 'group_filling_report'),
+    'teacher_schedule': (_teacher_schedule_result, 'teacher_schedule_report.html', 'teacher_schedule_report'),
+}
+
+def _job_export(job):
+    """
+    (filename, header, rows) for downloading a finished job's result.
+    """
+    result = job.result
+    if job.kind == 'group_filling':
+        rows = result['filling_data']['group_details'] if result['filling_data'] else []
+        return f'group_filling_{job.id}', exports.GROUP_FILLING_HEADER, rows
+    rows = [(lesson.teacher_name,) + tuple(lesson[2:8]) for lesson in result['schedule']]
+    return f'teacher_schedule_{job.id}', exports.TEACHERS_SCHEDULE_HEADER, rows
+
+@app.route('/reports/<kind>/job', methods=['POST'])
+def start_report_job(kind):
+    """
+    Queues a report in the background and redirects to its status page.
+    """
+    if kind not in REPORT_JOBS:
+        abort(404)
+    build, _, form_endpoint = REPORT_JOBS[kind]
+    if kind == 'teacher_schedule':
+        subject = request.form.getlist('teacher_id')
+    else:
+        subject = request.form.get('course_id')
+    if not subject:
+        abort(400)
+
+    try:
+        job_id = jobs.runner.submit(kind, build, subject, request.form['start_date'], request.form['end_date'])
+    except jobs.QueueFull:
+        flash('Очередь фоновых отчетов заполнена, попробуйте позже.', 'error')
+        return redirect(url_for(form_endpoint))
+    return redirect(url_for('report_job', job_id=job_id))
+
+def _get_job(job_id, result=False):
+    job = jobs.runner.get(job_id, result)
+    if job is None:
+        abort(404)
+    return job
+
+@app.route('/jobs/<job_id>')
+def report_job(job_id):
+    """
+    Shows the progress of a background report, then the report itself.
+    """
+    job = _get_job(job_id, result=True)
+    if job.status == 'done':
+        _, template, _ = REPORT_JOBS[job.kind]
+        return render_template(template, job=job, **job.result)
+    return render_template('job_status.html', job=job)
+
+@app.route('/jobs/<job_id>/status')
+def report_job_status(job_id):
+    """
+    Returns the status and progress of a background report as JSON.
+    """
+    return jsonify(_get_job(job_id).to_dict())
+
+@app.route('/jobs/<job_id>/download.<fmt>')
+def download_report_job(job_id, fmt):
+    """
+    Downloads the result of a finished background report.
+    """
+    job = _get_job(job_id, result=True)
+    if job.status != 'done':
+        abort(409)
+    return _export_response(fmt, *_job_export(job))
+
+# --- Search ---
+@app.route('/search')
+def search():
+    """
+    Searches organizations, courses and teachers at once, best matches first.
+    """
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', settings.SEARCH_LIMIT, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    results = db_requests.search_all(query, limit, offset) if query else []
+    return render_template('search.html', query=query, results=results, limit=limit, offset=offset)
+
+# --- Diagnostics ---
+@app.route('/cache/stats')
+def cache_stats():
+    """
+    Returns hit/miss counters of the in-process caches.
+    """
+    return jsonify({
+        'reference': db_requests.reference_cache.stats(),
+        'dashboard': db_requests.dashboard_stats_cache.stats(),
+        'report': db_requests.report_cache.stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Exposes query, connection pool, report cache and job metrics in the Prometheus text format.
+    """
+    pool = db.pool_stats()
+    gauges = {f'db_pool_{key}': pool[key]
+              for key in ('size', 'idle', 'in_use', 'waiting', 'checkouts', 'waits', 'timeouts', 'discarded')}
+    gauges.update({f'db_prepared_{key}': value for key, value in prepared.stats().items()})
+    gauges.update({f'report_cache_{key}': value for key, value in db_requests.report_cache.stats().items()
+                   if value is not None})
+    gauges.update({f'jobs_{key}': value for key, value in jobs.runner.stats().items()})
+    return Response(metrics.render_prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+# --- Exports ---
+def _export_response(fmt, filename, header, rows):
+    """
+    Streams rows as a CSV or XLSX attachment.
+    """
+    if fmt == 'csv':
+        body = exports.iter_csv(header, rows)
+        mimetype = exports.CSV_MIMETYPE
+    elif fmt == 'xlsx':
+        if not exports.xlsx_available():
+            abort(501, description='XLSX export requires the xlsxwriter package.')
+        body = exports.iter_xlsx(header, rows)
+        mimetype = exports.XLSX_MIMETYPE
+    else:
+        abort(404)
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'})
+
+@app.route('/export/training-requests.<fmt>')
+def export_training_requests(fmt):
+    """
+    Exports all training requests.
+    """
+    rows = db_requests.iter_all_training_requests()
+    return _export_response(fmt, 'training_requests', exports.TRAINING_REQUESTS_HEADER, rows)
+
+@app.route('/export/price-list.<fmt>')
+def export_price_list(fmt):
+    """
+    Exports the price list of an organization on a given date.
+    """
+    org_id = request.args['organization_id']
+    target_date = request.args['target_date']
+    rows = db_requests.iter_organization_price_list(org_id, target_date)
+    return _export_response(fmt, f'price_list_{org_id}_{target_date}', exports.PRICE_LIST_HEADER, rows)
+
+@app.route('/export/teacher-schedule.<fmt>')
+def export_teacher_schedule(fmt):
+    """
+    Exports the schedule of a teacher for a period.
+    """
+    teacher_id = request.args['teacher_id']
+    start_date = request.args['start_date']
+    end_date = request.args['end_date']
+    rows = db_requests.iter_teacher_schedule(teacher_id, start_date, end_date)
+    return _export_response(fmt, f'teacher_schedule_{teacher_id}_{start_date}_{end_date}',
+                            exports.TEACHER_SCHEDULE_HEADER, rows)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
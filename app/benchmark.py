@@ -0,0 +1,327 @@
+import argparse
+import fnmatch
+import json
+import math
+import platform
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import db_requests
+import migrations
+from db_conn import db
+
+DEFAULT_COUNTS = {
+    'organizations': 200,
+    'client_organizations': 2000,
+    'courses': 2000,
+    'teachers': 1000,
+    'training_requests': 200000,
+    'price_documents': 20000,
+    'teacher_assignments': 10000,
+    'schedule': 200000,
+}
+
+SEED_TABLES = ['schedule', 'teacher_assignments', 'price_documents', 'course_dates', 'training_requests',
+               'course_lead_teacher', 'course_tag_relationship', 'teacher_organization',
+               'courses', 'teachers', 'client_organizations', 'organizations']
+
+SEED_STATEMENTS = [
+    """
+    INSERT INTO organizations (code, name, address, phone, email)
+    SELECT 'ORG' || g, 'Организация ' || g, 'Адрес ' || g, '+375 17 ' || lpad(g::text, 7, '0'), 'org' || g || '@example.com'
+    FROM generate_series(1, %(organizations)s) g;
+    """,
+    """
+    INSERT INTO client_organizations (name, address, phone, email)
+    SELECT 'Клиент ' || g, 'Адрес клиента ' || g, NULL, NULL
+    FROM generate_series(1, %(client_organizations)s) g;
+    """,
+    """
+    INSERT INTO courses (code, name, type_id, training_days, max_students, base_price, organization_id, is_active)
+    SELECT 'C' || g, 'Курс ' || md5(g::text), t.ids[1 + g %% array_length(t.ids, 1)],
+           1 + g %% 30, 10 + g %% 20, 1000 + (g %% 50) * 100, 1 + g %% %(organizations)s, g %% 10 <> 0
+    FROM generate_series(1, %(courses)s) g,
+         (SELECT array_agg(id ORDER BY id) AS ids FROM course_types) t;
+    """,
+    """
+    INSERT INTO teachers (code, full_name, birth_date, gender, education, category)
+    SELECT 'T' || g, 'Преподаватель ' || md5(g::text), DATE '1960-01-01' + g %% 15000,
+           CASE WHEN g %% 2 = 0 THEN 'M' ELSE 'F' END, 'Высшее', 'Категория ' || (g %% 3 + 1)
+    FROM generate_series(1, %(teachers)s) g;
+    """,
+    """
+    INSERT INTO training_requests (request_number, request_date, client_organization_id, course_id,
+                                   required_deadline, total_students, status)
+    SELECT 'R' || g, CURRENT_DATE - g %% 1500, 1 + g %% %(client_organizations)s, 1 + g %% %(courses)s,
+           CURRENT_DATE - g %% 1500 + 30, 1 + g %% 30,
+           (ARRAY['новая', 'подтверждена', 'отклонена', 'завершена'])[1 + g %% 4]
+    FROM generate_series(1, %(training_requests)s) g;
+    """,
+    """
+    INSERT INTO course_dates (training_request_id, start_date, end_date)
+    SELECT id, required_deadline, required_deadline + 5
+    FROM training_requests;
+    """,
+    """
+    INSERT INTO price_documents (document_number, document_date, price, course_id)
+    SELECT 'P' || g, CURRENT_DATE - g %% 2000, 1000 + (g %% 90) * 50, 1 + g %% %(courses)s
+    FROM generate_series(1, %(price_documents)s) g;
+    """,
+    """
+    INSERT INTO teacher_assignments (document_number, document_date, teacher_id, course_id, start_date, end_date)
+    SELECT 'A' || g, CURRENT_DATE - g %% 700, 1 + g %% %(teachers)s, 1 + g %% %(courses)s,
+           CURRENT_DATE - g %% 700, CURRENT_DATE - g %% 700 + 60
+    FROM generate_series(1, %(teacher_assignments)s) g;
+    """,
+    """
+    INSERT INTO schedule (teacher_assignment_id, lesson_date, start_time, end_time)
+    SELECT 1 + g %% %(teacher_assignments)s, CURRENT_DATE - g %% 700,
+           TIME '08:00' + (g %% 10) * INTERVAL '1 hour',
+           TIME '08:00' + (g %% 10) * INTERVAL '1 hour' + INTERVAL '90 minutes'
+    FROM generate_series(1, %(schedule)s) g;
+    """,
+]
+
+
+def seed(counts):
+    """
+    Replaces the contents of the application tables with generated data.
+    Destructive: intended for a local benchmark database only.
+    """
+    migrations.upgrade()
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(SEED_TABLES)} RESTART IDENTITY CASCADE;")
+        for statement in SEED_STATEMENTS:
+            started = time.perf_counter()
+            cur.execute(statement, counts)
+            print(f'{statement.split()[2]:<22} {cur.rowcount:>9} rows  {time.perf_counter() - started:6.2f}s')
+        cur.execute('ANALYZE;')
+
+
+def _row_count(result):
+    if result is None:
+        return 0
+    if hasattr(result, 'rows'):
+        return len(result.rows)
+    if isinstance(result, dict):
+        if 'group_details' in result:
+            return len(result['group_details'])
+        return sum(_row_count(value) for value in result.values())
+    if isinstance(result, (list, tuple)) and result and isinstance(result[0], (list, tuple, dict)):
+        return len(result)
+    return 1
+
+
+def _cases(counts, rng):
+    def any_id(table):
+        return rng.randint(1, counts[table])
+
+    def period(days):
+        end = date.today() - timedelta(days=rng.randint(0, 365))
+        return end - timedelta(days=days), end
+
+    def deep_page(fetch_page, pages=20):
+        page = fetch_page()
+        for _ in range(pages - 1):
+            if not page.next_cursor:
+                break
+            page = fetch_page(after=page.next_cursor)
+        return page
+
+    return [
+        # списки
+        ('list.get_all_organizations', lambda: db_requests.get_all_organizations()),
+        ('list.get_all_courses', lambda: db_requests.get_all_courses()),
+        ('list.get_all_teachers', lambda: db_requests.get_all_teachers()),
+        ('list.get_all_client_organizations', lambda: db_requests.get_all_client_organizations()),
+        ('list.get_organizations_page', lambda: db_requests.get_organizations_page()),
+        ('list.get_courses_page', lambda: db_requests.get_courses_page()),
+        ('list.get_teachers_page', lambda: db_requests.get_teachers_page()),
+        ('list.get_training_requests_page', lambda: db_requests.get_training_requests_page()),
+        ('list.get_training_requests_page_deep', lambda: deep_page(db_requests.get_training_requests_page)),
+        ('list.get_training_requests_by_status', lambda: db_requests.get_training_requests_by_status('новая')),
+        ('list.get_courses_by_organization', lambda: db_requests.get_courses_by_organization(any_id('organizations'))),
+        ('list.get_teacher_assignments', lambda: db_requests.get_teacher_assignments(teacher_id=any_id('teachers'))),
+        ('list.get_teacher_courses', lambda: db_requests.get_teacher_courses(any_id('teachers'))),
+        ('list.get_price_documents_by_course', lambda: db_requests.get_price_documents_by_course(any_id('courses'))),
+        ('list.get_course_dates_by_course', lambda: db_requests.get_course_dates_by_course(any_id('courses'))),
+        ('list.get_schedule_by_assignment', lambda: db_requests.get_schedule_by_assignment(any_id('teacher_assignments'))),
+        ('list.get_dashboard_stats', lambda: db_requests.get_dashboard_stats(estimate=False)),
+        ('list.get_dashboard_stats_estimate', lambda: db_requests.get_dashboard_stats(estimate=True)),
+        # выборка по id
+        ('by_id.get_organization_by_id', lambda: db_requests.get_organization_by_id(any_id('organizations'))),
+        ('by_id.get_course_by_id', lambda: db_requests.get_course_by_id(any_id('courses'))),
+        ('by_id.get_teacher_by_id', lambda: db_requests.get_teacher_by_id(any_id('teachers'))),
+        ('by_id.get_training_request_by_id', lambda: db_requests.get_training_request_by_id(any_id('training_requests'))),
+        ('by_id.get_current_price', lambda: db_requests.get_current_price(any_id('courses'))),
+        ('by_id.get_course_lead_teacher', lambda: db_requests.get_course_lead_teacher(any_id('courses'))),
+        ('by_id.get_course_dates_by_request', lambda: db_requests.get_course_dates_by_request(any_id('training_requests'))),
+        # поиск
+        ('search.search_organizations', lambda: db_requests.search_organizations(str(rng.randint(1, 99)))),
+        ('search.search_courses', lambda: db_requests.search_courses(f'{rng.randint(0, 255):02x}')),
+        ('search.search_teachers', lambda: db_requests.search_teachers(f'{rng.randint(0, 255):02x}')),
+        ('search.search_all', lambda: db_requests.search_all(f'{rng.randint(0, 255):02x}')),
+        # отчеты
+        ('report.get_organization_price_list',
+         lambda: db_requests.get_organization_price_list(any_id('organizations'), period(0)[1])),
+        ('report.get_organization_price_lists',
+         lambda: db_requests.get_organization_price_lists(
+             [any_id('organizations') for _ in range(10)], [period(0)[1], period(30)[0]])),
+        ('report.get_course_group_filling',
+         lambda: db_requests.get_course_group_filling(any_id('courses'), *period(365))),
+        ('report.get_courses_group_filling',
+         lambda: db_requests.get_courses_group_filling(*period(90), organization_id=any_id('organizations'))),
+        ('report.get_teacher_schedule',
+         lambda: db_requests.get_teacher_schedule(any_id('teachers'), *period(90))),
+        ('report.get_teachers_schedule',
+         lambda: db_requests.get_teachers_schedule([any_id('teachers') for _ in range(20)], *period(90))),
+        ('report.get_teachers_lessons_summary',
+         lambda: db_requests.get_teachers_lessons_summary([any_id('teachers') for _ in range(20)], *period(90))),
+        ('report.get_course_schedule',
+         lambda: db_requests.get_course_schedule(any_id('courses'), *period(90))),
+    ]
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _clear_caches():
+    # Измеряем обращение к базе, а не попадание в кэш
+    db_requests.dashboard_stats_cache.invalidate()
+    db_requests.reference_cache.invalidate()
+    db_requests.report_cache.invalidate()
+
+
+def run(counts, iterations=30, warmup=3, only=None, seed_value=42):
+    rng = random.Random(seed_value)
+    results = {}
+    for name, call in _cases(counts, rng):
+        if only and not any(fnmatch.fnmatch(name, pattern) for pattern in only):
+            continue
+
+        for _ in range(warmup):
+            _clear_caches()
+            call()
+
+        timings = []
+        rows = 0
+        for _ in range(iterations):
+            _clear_caches()
+            started = time.perf_counter()
+            result = call()
+            timings.append(time.perf_counter() - started)
+            rows += _row_count(result)
+
+        timings.sort()
+        total = sum(timings)
+        results[name] = {
+            'calls': iterations,
+            'p50_ms': round(_percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(_percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(_percentile(timings, 99) * 1000, 3),
+            'mean_ms': round(total / iterations * 1000, 3),
+            'rows': rows,
+            'rows_per_sec': round(rows / total, 1) if total else None,
+        }
+        print(f"{name:<45} p50 {results[name]['p50_ms']:>9.2f} ms  p95 {results[name]['p95_ms']:>9.2f} ms  "
+              f"p99 {results[name]['p99_ms']:>9.2f} ms  {results[name]['rows_per_sec'] or 0:>12.0f} rows/s")
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'iterations': iterations,
+            'counts': counts,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2, metric='p95_ms'):
+    """
+    Returns (name, baseline_value, current_value, ratio) for every function whose
+    `metric` grew by more than `tolerance` relative to the baseline.
+    """
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get(metric):
+            continue
+        ratio = current[metric] / previous[metric]
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous[metric], current[metric], ratio))
+    return regressions
+
+
+def _parse_counts(args):
+    counts = dict(DEFAULT_COUNTS)
+    for table in counts:
+        value = getattr(args, table)
+        if value is not None:
+            counts[table] = value
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for db_requests against a local PostgreSQL.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""Baselines are machine-specific, so none is shipped. To check a change:
+  DB_NAME=bench python benchmark.py seed --yes
+  git switch main && DB_NAME=bench python benchmark.py run --output baseline.json
+  git switch - && DB_NAME=bench python benchmark.py run --baseline baseline.json
+Use the same counts, iterations and machine for both runs.""")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    seed_parser = subparsers.add_parser('seed', help='DESTRUCTIVE: truncate the tables and load generated data')
+    seed_parser.add_argument('--yes', action='store_true',
+                             help='confirm that the configured database may be wiped')
+    run_parser = subparsers.add_parser('run', help='time every db_requests function')
+    for sub in (seed_parser, run_parser):
+        for table, default in DEFAULT_COUNTS.items():
+            sub.add_argument(f"--{table.replace('_', '-')}", dest=table, type=int,
+                             help=f'row count (default {default})')
+
+    run_parser.add_argument('--iterations', type=int, default=30)
+    run_parser.add_argument('--warmup', type=int, default=3)
+    run_parser.add_argument('--only', action='append', help='glob over case names, e.g. "report.*"')
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    run_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 growth (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    counts = _parse_counts(args)
+    if args.command == 'seed':
+        if not args.yes:
+            parser.error(f'seed truncates every application table in database {db.dbname!r} '
+                         f'on {db.host}:{db.port}; pass --yes to confirm')
+        seed(counts)
+        sys.exit(0)
+
+    baseline = None
+    if args.baseline:
+        # читаем до прогона: отсутствующий файл не должен обнаружиться через полчаса
+        try:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except OSError as e:
+            parser.error(f'cannot read baseline {args.baseline}: {e.strerror} (see the end of --help)')
+
+    report = run(counts, iterations=args.iterations, warmup=args.warmup, only=args.only)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'results written to {args.output}')
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for name, before, after, ratio in regressions:
+            print(f'REGRESSION {name}: p95 {before:.2f} ms -> {after:.2f} ms (x{ratio:.2f})')
+        if regressions:
+            sys.exit(1)
+        print('no regressions against baseline')
@@ -0,0 +1,215 @@
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+# Сколько последних сброшенных ключей/тегов помнит кэш
+INVALIDATION_HISTORY = 1024
+
+
+def _key_part(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(str(item) for item in value)
+    # '5' и 5, '2024-01-01' и date(2024, 1, 1) дают один ключ
+    return str(value)
+
+
+def _memo_key(name, args, kwargs):
+    return (name,) + tuple(_key_part(arg) for arg in args) + tuple(
+        (kwarg, _key_part(value)) for kwarg, value in sorted(kwargs.items()))
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache whose entries expire after `ttl` seconds.
+    When `maxsize` is set, the least recently used entry is evicted first.
+    Entries can carry tags, so a write can drop just the entries built from
+    the rows it changed (see invalidate_tags).
+    """
+
+    def __init__(self, ttl=60.0, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._tagged = {}
+        self._lock = threading.Lock()
+        # Счетчик сбросов и номер последнего сброса каждого ключа/тега (см. get_or_set);
+        # о сбросах до _forgotten уже ничего не известно
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._forgotten = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key):
+        """
+        Whether `key` holds a live entry; unlike get() it is not counted as a hit or miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def _stale(self, generation, names):
+        if generation < self._forgotten:
+            return True
+        return any(self._invalidated.get(name, -1) > generation for name in names)
+
+    def _mark_invalidated(self, names):
+        self._generation += 1
+        for name in names:
+            self._invalidated[name] = self._generation
+            self._invalidated.move_to_end(name)
+        while len(self._invalidated) > INVALIDATION_HISTORY:
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    def _drop(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def set(self, key, value, tags=(), generation=None):
+        tags = frozenset(tags)
+        with self._lock:
+            if generation is not None and self._stale(generation, (key,) + tuple(tags)):
+                # пока значение считалось, его ключ или теги сбросили
+                return
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._drop(next(iter(self._data)))
+                    self.evictions += 1
+
+    def get_or_set(self, key, factory, tags=()):
+        """
+        Returns the cached value or computes and stores it. A value whose
+        computation overlapped an invalidation is returned but not stored.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            generation = self._generation
+            value = factory()
+            self.set(key, value, tags, generation)
+        return value
+
+    async def aget_or_set(self, key, factory, tags=()):
+        """
+        get_or_set() for a coroutine function `factory`.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            generation = self._generation
+            value = await factory()
+            self.set(key, value, tags, generation)
+        return value
+
+    def cached(self, key):
+        """
+        Caches the result of a function without arguments under `key`;
+        `wrapper.is_cached()` tells whether a call would be a hit. Coroutine
+        functions share the entries of their synchronous counterparts.
+        """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper():
+                    return await self.aget_or_set(key, func)
+            else:
+                @functools.wraps(func)
+                def wrapper():
+                    return self.get_or_set(key, func)
+            wrapper.is_cached = lambda: self.contains(key)
+            return wrapper
+        return decorator
+
+    def memoize(self, name, tags):
+        """
+        Caches a function by its arguments. `tags(*args, **kwargs)` returns
+        the tags of a result, e.g. the table names and ('course', id) pairs it
+        was built from. `wrapper.is_cached(*args, **kwargs)` tells whether a
+        call would be a hit.
+        """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    return await self.aget_or_set(_memo_key(name, args, kwargs),
+                                                  lambda: func(*args, **kwargs), tags(*args, **kwargs))
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    return self.get_or_set(_memo_key(name, args, kwargs),
+                                           lambda: func(*args, **kwargs), tags(*args, **kwargs))
+            wrapper.is_cached = lambda *args, **kwargs: self.contains(_memo_key(name, args, kwargs))
+            return wrapper
+        return decorator
+
+    def invalidate(self, *keys):
+        with self._lock:
+            if not keys:
+                self._generation += 1
+                self._forgotten = self._generation
+                self._invalidated.clear()
+                self.invalidations += len(self._data)
+                self._data.clear()
+                self._tagged.clear()
+                return
+            self._mark_invalidated(keys)
+            for key in keys:
+                if key in self._data:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def invalidate_tags(self, *tags):
+        """
+        Drops every entry carrying any of `tags`.
+        """
+        with self._lock:
+            self._mark_invalidated(tags)
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'tags': len(self._tagged),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,160 @@
+import zlib
+
+from flask import request
+
+from config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+}
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        # Z_SYNC_FLUSH отдает клиенту все, что накоплено, не закрывая поток
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=min(max(level, 0), 11))
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=min(max(level, 1), 22)).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+_CODECS = {'gzip': _Gzip}
+if brotli is not None:
+    _CODECS['br'] = _Brotli
+if zstandard is not None:
+    _CODECS['zstd'] = _Zstd
+
+
+def available_encodings():
+    """
+    Encodings from COMPRESSION_ENCODINGS (in preference order) whose library is installed.
+    """
+    configured = [encoding.strip() for encoding in settings.COMPRESSION_ENCODINGS.split(',')]
+    return [encoding for encoding in configured if encoding in _CODECS]
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """
+    Picks the first of `encodings` the client accepts (q > 0) according to
+    an Accept-Encoding header; returns None when none matches.
+    """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+
+    for encoding in available_encodings() if encodings is None else encodings:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def _compress_stream(chunks, codec):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = codec.compress(chunk) + codec.flush()
+        if data:
+            yield data
+    yield codec.finish()
+
+
+def compress_response(response, accept_encoding):
+    """
+    Compresses a Flask response in place when it is worth it: compressible
+    mimetype, not already encoded, at least COMPRESSION_MIN_SIZE bytes.
+    Streamed responses are compressed chunk by chunk and flushed after each
+    chunk, so they keep streaming.
+    """
+    if not settings.COMPRESSION_ENABLED or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough:
+        # send_file и подобные - отдаем как есть
+        return response
+
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    codec = _CODECS[encoding](settings.COMPRESSION_LEVEL)
+    if response.is_streamed:
+        if response.content_length is not None and response.content_length < settings.COMPRESSION_MIN_SIZE:
+            return response
+        response.response = _compress_stream(response.response, codec)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(codec.compress(body) + codec.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление отличается побайтно - ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request.headers.get('Accept-Encoding'))
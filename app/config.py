@@ -13,6 +13,40 @@ class Config:
     DB_USER = os.environ.get('DB_USER') 
     DB_PASSWORD = os.environ.get('DB_PASSWORD') 
     DB_URL=os.environ.get('DB_URL')
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_PARALLEL_WORKERS = int(os.environ.get('DB_PARALLEL_WORKERS', 4))
+    DB_PARALLEL_PER_REQUEST = int(os.environ.get('DB_PARALLEL_PER_REQUEST', 2))
+    DB_PARALLEL_TIMEOUT = float(os.environ.get('DB_PARALLEL_TIMEOUT', 60))
+    DB_ASYNC_POOL_MIN = int(os.environ.get('DB_ASYNC_POOL_MIN', 1))
+    DB_ASYNC_POOL_MAX = int(os.environ.get('DB_ASYNC_POOL_MAX', 4))
+    DB_HEALTH_CHECK = os.environ.get('DB_HEALTH_CHECK', 'idle')
+    DB_HEALTH_CHECK_IDLE = float(os.environ.get('DB_HEALTH_CHECK_IDLE', 60))
+    DASHBOARD_STATS_TTL = float(os.environ.get('DASHBOARD_STATS_TTL', 10))
+    DASHBOARD_STATS_ESTIMATE = bool(os.environ.get('DASHBOARD_STATS_ESTIMATE'))
+    DASHBOARD_STATS_ESTIMATE_THRESHOLD = int(os.environ.get('DASHBOARD_STATS_ESTIMATE_THRESHOLD', 100000))
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+    SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 20))
+    REFERENCE_CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', 300))
+    REFERENCE_CACHE_SIZE = int(os.environ.get('REFERENCE_CACHE_SIZE', 64))
+    REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 600))
+    REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 512))
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 10))
+    JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 3600))
+    JOB_CHUNK_DAYS = int(os.environ.get('JOB_CHUNK_DAYS', 92))
+    EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', 2000))
+    EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 500))
+    DB_METRICS = os.environ.get('DB_METRICS', 'on') != 'off'
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))
+    DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', 'on') != 'off'
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION', 'on') != 'off'
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_ENCODINGS = os.environ.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip')
+    TABLE_VERSIONS_INTERVAL = float(os.environ.get('TABLE_VERSIONS_INTERVAL', 1.0))
 
 
 
@@ -1,5 +1,252 @@
+import functools
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 from config import *
+from instrumentation import InstrumentedCursor
+from rows import RecordCursor
+
+
+HEALTH_CHECK_NEVER = 'never'
+HEALTH_CHECK_IDLE = 'idle'
+HEALTH_CHECK_ALWAYS = 'always'
+HEALTH_CHECK_POLICIES = (HEALTH_CHECK_NEVER, HEALTH_CHECK_IDLE, HEALTH_CHECK_ALWAYS)
+
+
+def instance_name():
+    """
+    Identifies this process to the server (application_name); the version
+    triggers record it to tell this process's writes from everyone else's.
+    """
+    # pid берется при подключении, а не при импорте: воркеры gunicorn форкаются позже
+    return f'training-app:{socket.gethostname()}:{os.getpid()}'[:63]
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionLost(psycopg2.OperationalError):
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    last_used = 0.0
+    # имена выполненных на этом соединении PREPARE (см. prepared.py)
+    prepared_statements = None
+
+
+class ConnectionPool:
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0,
+                 health_check=HEALTH_CHECK_IDLE, health_check_idle=60.0):
+        if minconn > maxconn:
+            raise ValueError('minconn must not exceed maxconn')
+        if health_check not in HEALTH_CHECK_POLICIES:
+            raise ValueError(f'Unknown health check policy: {health_check!r}')
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check = health_check
+        self.health_check_idle = health_check_idle
+
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._waiting = 0
+        self._discarded = 0
+        self._pings = 0
+        self._ping_failures = 0
+
+    def _fill(self):
+        # Прогреваем пул до минимального размера вне блокировки
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        if self._size < self.minconn:
+            self._fill()
+
+        while True:
+            conn, reused = self._checkout(timeout)
+            if not reused or not self._needs_ping(conn) or self._ping(conn):
+                return conn
+            self.putconn(conn, discard=True)
+
+    def _needs_ping(self, conn):
+        if self.health_check == HEALTH_CHECK_ALWAYS:
+            return True
+        if self.health_check == HEALTH_CHECK_IDLE:
+            return time.monotonic() - conn.last_used >= self.health_check_idle
+        return False
+
+    def _ping(self, conn):
+        with self._cond:
+            self._pings += 1
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            with self._cond:
+                self._ping_failures += 1
+            return False
+
+    def _checkout(self, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        conn = None
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f'No database connection available within {timeout:.1f}s '
+                        f'(pool size {self._size}/{self.maxconn})')
+
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += time.monotonic() - started
+
+        if conn is not None:
+            return conn, True
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn, False
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed:
+                self._size -= 1
+                self._discarded += 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if conn.closed:
+                # После рестарта сервера мертвы и остальные простаивающие соединения:
+                # иначе повтор в idempotent получит одно из них
+                self.discard_idle(before=time.monotonic())
+                if not isinstance(e, ConnectionLost):
+                    raise ConnectionLost(str(e)) from e
+            raise
+        finally:
+            self.putconn(conn)
+
+    def discard_idle(self, before):
+        """
+        Closes idle connections last returned before `before` (a monotonic
+        time); returns how many were closed.
+        """
+        with self._cond:
+            stale = [conn for conn in self._idle if conn.last_used < before]
+            if not stale:
+                return 0
+            self._idle = deque(conn for conn in self._idle if conn.last_used >= before)
+            self._size -= len(stale)
+            self._discarded += len(stale)
+            self._cond.notify_all()
+        for conn in stale:
+            if not conn.closed:
+                conn.close()
+        return len(stale)
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn = self._idle.pop()
+                self._size -= 1
+                if not conn.closed:
+                    conn.close()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'health_check': self.health_check,
+                'pings': self._pings,
+                'ping_failures': self._ping_failures,
+            }
+
 
 class DBConnect:
     host = None
@@ -8,46 +255,107 @@ class DBConnect:
     password = None
     port = None
 
-    connection = None
+    pool = None
 
-    def __init__(self, host, dbname, user, password, port=5432):
+    def __init__(self, host, dbname, user, password, port=5432,
+                 pool_min=1, pool_max=10, pool_timeout=30.0,
+                 health_check=HEALTH_CHECK_IDLE, health_check_idle=60.0, cursor_factory=None):
         self.host = host
         self.dbname = dbname
         self.user = user
         self.password = password
         self.port = port
+        self.cursor_factory = cursor_factory
+        self._local = threading.local()
+        self.pool = ConnectionPool(
+            self._create_db_connection,
+            minconn=pool_min,
+            maxconn=pool_max,
+            timeout=pool_timeout,
+            health_check=health_check,
+            health_check_idle=health_check_idle,
+        )
 
     def _create_db_connection(self):
-        self.connection = psycopg2.connect(
+        connection = psycopg2.connect(
             dbname=self.dbname,
             user=self.user,
             password=self.password,
             host=self.host,
             port=self.port,
+            application_name=instance_name(),
             keepalives=1,
             keepalives_idle=30,
             keepalives_interval=10,
             keepalives_count=5,
+            connection_factory=PooledConnection,
+            cursor_factory=self.cursor_factory,
         )
-        self.connection.autocommit = True
-        return self.connection
+        connection.autocommit = True
+        return connection
+
+    def get_connection(self, timeout=None):
+        """
+        Checks a connection out of the pool; use as a context manager so the
+        connection is returned when the block exits. Inside transaction() the
+        thread's transaction connection is returned instead.
+        """
+        connection = getattr(self._local, 'transaction', None)
+        if connection is not None:
+            return _joined(connection)
+        return self.pool.connection(timeout)
 
-    def get_connection(self):
-        if self.connection and not self.connection.closed:
+    @contextmanager
+    def transaction(self, timeout=None):
+        """
+        Unit of work: every db_requests call made by this thread inside the
+        block runs on one connection in one transaction, committed when the
+        block exits and rolled back on an exception. Nested calls join the
+        outer transaction.
+        """
+        connection = getattr(self._local, 'transaction', None)
+        if connection is not None:
+            yield connection
+            return
+
+        with self.pool.connection(timeout) as connection:
+            connection.autocommit = False
+            self._local.transaction = connection
+            self._local.after_commit = []
             try:
-                with self.connection.cursor() as cursor:
-                    cursor.execute('SELECT 1')
-            except psycopg2.OperationalError:
-                return self._create_db_connection()
+                yield connection
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                self._local.transaction = None
+                callbacks, self._local.after_commit = self._local.after_commit, []
+        for callback in callbacks:
+            callback()
 
-            return self.connection
+    def after_commit(self, callback):
+        """
+        Calls `callback` once the thread's transaction commits (dropped on
+        rollback), or right away outside transaction().
+        """
+        if getattr(self._local, 'transaction', None) is None:
+            callback()
         else:
-            return self._create_db_connection()
+            self._local.after_commit.append(callback)
+
+    def in_transaction(self):
+        return getattr(self._local, 'transaction', None) is not None
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.closeall()
 
     def test_connection(self):
         try:
-            conn = self.get_connection()
-            with conn.cursor() as cursor:
+            with self.get_connection() as conn, conn.cursor() as cursor:
                 cursor.execute("SELECT version();")
                 version = cursor.fetchone()
                 print(f"PostgreSQL: {version[0]}")
@@ -57,14 +365,41 @@ class DBConnect:
             return False
 
 
+@contextmanager
+def _joined(connection):
+    # Соединение принадлежит транзакции - в пул его вернет transaction()
+    yield connection
+
+
+def idempotent(func):
+    """
+    Retries a read-only query function once on a fresh connection when the
+    pooled connection it used turns out to be dead. The pool drops the idle
+    connections that predate the failure first, so the retry does not pick
+    up another connection killed by the same server restart.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except ConnectionLost:
+            return func(*args, **kwargs)
+    return wrapper
+
 
 DB_CONNECTION = {
     'host': settings.DB_HOST,
-    'dbname': settings.DB_NAME, 
+    'dbname': settings.DB_NAME,
     'user': settings.DB_USER,
     'password': settings.DB_PASSWORD,
-    'port': settings.DB_PORT
+    'port': settings.DB_PORT,
+    'pool_min': settings.DB_POOL_MIN,
+    'pool_max': settings.DB_POOL_MAX,
+    'pool_timeout': settings.DB_POOL_TIMEOUT,
+    'health_check': settings.DB_HEALTH_CHECK,
+    'health_check_idle': settings.DB_HEALTH_CHECK_IDLE,
+    'cursor_factory': InstrumentedCursor if settings.DB_METRICS else RecordCursor,
 }
 
 
-db = DBConnect(**DB_CONNECTION)
\ No newline at end of file
+db = DBConnect(**DB_CONNECTION)
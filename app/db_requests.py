@@ -1,9 +1,138 @@
+from datetime import date
+
+import dependencies
+import pagination
+import prepared
+import rows
+from gateway import TableGateway
+from versions import versions
+from cache import TTLCache
 from config import settings
-from db_conn import db
+from db_conn import db, idempotent
+
+dashboard_stats_cache = TTLCache(ttl=settings.DASHBOARD_STATS_TTL)
+# Справочники для выпадающих списков; сбрасываются функциями записи
+reference_cache = TTLCache(ttl=settings.REFERENCE_CACHE_TTL, maxsize=settings.REFERENCE_CACHE_SIZE)
+# Результаты отчетов; теги - таблицы и ('course'|'organization'|'teacher', id)
+report_cache = TTLCache(ttl=settings.REPORT_CACHE_TTL, maxsize=settings.REPORT_CACHE_SIZE)
+
+organizations_table = TableGateway('organizations',
+    {'code': 'varchar', 'name': 'varchar', 'address': 'text', 'phone': 'varchar', 'email': 'varchar'},
+    returning=['id', 'code', 'name', 'address', 'phone', 'email'])
+courses_table = TableGateway('courses',
+    {'code': 'varchar', 'name': 'varchar', 'type_id': 'integer', 'training_days': 'integer',
+     'max_students': 'integer', 'base_price': 'numeric', 'organization_id': 'integer', 'is_active': 'boolean'},
+    returning=['id', 'code', 'name', 'organization_id'])
+course_dates_table = TableGateway('course_dates',
+    {'start_date': 'date', 'end_date': 'date'},
+    returning=['id', 'start_date', 'end_date'])
+teachers_table = TableGateway('teachers',
+    {'code': 'varchar', 'full_name': 'varchar', 'birth_date': 'date', 'gender': 'char',
+     'education': 'varchar', 'category': 'varchar'},
+    returning=['id', 'code', 'full_name'])
+training_requests_table = TableGateway('training_requests',
+    {'request_number': 'varchar', 'client_organization_id': 'integer', 'course_id': 'integer',
+     'required_deadline': 'date', 'total_students': 'integer', 'status': 'varchar'},
+    returning=['id', 'request_number', 'status'])
+
+def _iter_query(query, params, itersize=None):
+    # Именованный (серверный) курсор живет только внутри транзакции;
+    # пул откатит ее и вернет autocommit, когда соединение вернется
+    with db.get_connection() as connection:
+        connection.autocommit = False
+        with connection.cursor(name='export_cursor') as cur:
+            cur.itersize = itersize or settings.EXPORT_ITERSIZE
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+
+def _bulk_update(table, rows):
+    # Все группы колонок обновляются в одной транзакции
+    with db.transaction() as connection, connection.cursor() as cur:
+        result = table.bulk_update(cur, rows)
+    return result
+
+def _changed(*tables, keys=None):
+    # Сбрасываем справочники и отчеты этого процесса; версии таблиц для ETag
+    # сдвигают триггеры table_versions.
+    # keys - теги затронутых строк; без них сбрасываются все отчеты по этим таблицам.
+    # Внутри транзакции - только после COMMIT, иначе кэш заполнят незафиксированным
+    def invalidate():
+        reference_cache.invalidate(*tables)
+        report_cache.invalidate_tags(*(tables if keys is None else keys))
+    db.after_commit(invalidate)
+
+def invalidate_caches(*tables, keys=None):
+    """
+    Drops this process's cached reference lists and reports built from
+    `tables` after a write made outside db_requests (e.g. the CSV importer);
+    `keys` narrows the reports to the affected rows.
+    """
+    _changed(*tables, keys=keys)
+
+@versions.on_change
+def _changed_elsewhere(*tables):
+    # Чужие изменения: какие строки затронуты, неизвестно - сбрасываем таблицы целиком.
+    # Поэтому точный сброс по тегам строк работает только в процессе, который писал;
+    # при нескольких воркерах остальные теряют все отчеты по измененной таблице
+    reference_cache.invalidate(*tables)
+    report_cache.invalidate_tags(*tables)
+
+def _price_list_tags(org_id, target_date, columnar=False):
+    return ['courses', 'course_types', 'price_documents', ('organization', int(org_id))]
+
+def _group_filling_tags(course_id, start_date, end_date):
+    return ['courses', 'training_requests', ('course', int(course_id))]
+
+def _teacher_schedule_tags(teacher_ids, start_date, end_date, columnar=False):
+    if not isinstance(teacher_ids, (list, tuple, set)):
+        teacher_ids = [teacher_ids]
+    return ['teachers', 'courses', 'teacher_assignments', 'schedule'] + [
+        ('teacher', int(teacher_id)) for teacher_id in teacher_ids]
+
+REFERENCES_QUERIES = {table: dependencies.references_query(table) for table in dependencies.REFERENCES}
+DELETE_QUERIES = {table: dependencies.delete_query(table) for table in dependencies.REFERENCES}
+
+@idempotent
+def get_references(table, ids):
+    """
+    Answers "is this row referenced?" for many ids of organizations, courses
+    or teachers at once: {id: [referencing tables]}, an empty list means the
+    row can be deleted. Ids that do not exist are left out.
+    """
+    ids = [int(row_id) for row_id in ids]
+    if not ids:
+        return {}
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(REFERENCES_QUERIES[table], (ids,))
+        result = {row[0]: list(row[1]) for row in cur.fetchall()}
+        return result
+
+def _batch_delete(table, ids, keys=None):
+    # keys(deleted) - теги отчетов по удаленным строкам
+    ids = [int(row_id) for row_id in ids]
+    if not ids:
+        return dependencies.BatchDeleteResult([], {}, [])
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(DELETE_QUERIES[table], (ids,))
+        result = dependencies.batch_delete_result(ids, cur.fetchall())
+    if result.deleted:
+        _changed(table, keys=None if keys is None else keys(result.deleted))
+    return result
+
+def _search_params(search_term, limit=None, offset=0):
+    search_term = search_term.strip()
+    escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    limit = settings.SEARCH_LIMIT if limit is None else min(max(int(limit), 1), settings.MAX_PAGE_SIZE)
+    return {
+        'term': search_term,
+        'pattern': f'%{escaped}%',
+        'limit': limit,
+        'offset': max(int(offset or 0), 0),
+    }
 
 def add_organization(code, name, address, phone=None, email=None):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO organizations (code, name, address, phone, email)
             VALUES (%s, %s, %s, %s, %s)
@@ -11,94 +140,90 @@ def add_organization(code, name, address, phone=None, email=None):
             """,
             (code, name, address, phone, email))
         result = cur.fetchone()
+        if result:
+            _changed('organizations')
         return result
 
-def get_all_organizations():
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ALL_ORGANIZATIONS_QUERY = """
             SELECT id, code, name, address, phone, email 
             FROM organizations 
             ORDER BY id;
-            """)
+            """
+
+@reference_cache.cached('organizations')
+@idempotent
+def get_all_organizations():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(ALL_ORGANIZATIONS_QUERY)
         result = cur.fetchall()
         return result
 
-def get_organization_by_id(org_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ORGANIZATIONS_PAGE_QUERY = """
+            SELECT id, code, name, address, phone, email
+            FROM organizations
+            {where}"""
+
+@idempotent
+def get_organizations_page(after=None, before=None, limit=None):
+    sql, params, limit, backward = pagination.keyset_query(ORGANIZATIONS_PAGE_QUERY,
+        ['id'], [int], after=after, before=before, limit=limit)
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return pagination.build_page(rows, lambda row: (row[0],), limit, backward, bool(after or before))
+
+ORGANIZATION_BY_ID_QUERY = """
             SELECT id, code, name, address, phone, email 
             FROM organizations 
             WHERE id = %s;
-            """,
+            """
+ORGANIZATION_BY_ID = prepared.statement('organization_by_id', ORGANIZATION_BY_ID_QUERY)
+
+@idempotent
+def get_organization_by_id(org_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, ORGANIZATION_BY_ID,
             (org_id,))
         result = cur.fetchone()
         return result
 
 def update_organization(org_id, code=None, name=None, address=None, phone=None, email=None):
-    connection = db.get_connection()
-    
-    update_fields = []
-    params = []
-    
-    if code is not None:
-        update_fields.append("code = %s")
-        params.append(code)
-    if name is not None:
-        update_fields.append("name = %s")
-        params.append(name)
-    if address is not None:
-        update_fields.append("address = %s")
-        params.append(address)
-    if phone is not None:
-        update_fields.append("phone = %s")
-        params.append(phone)
-    if email is not None:
-        update_fields.append("email = %s")
-        params.append(email)
-        
-    if not update_fields:
-        return None
-        
-    params.append(org_id)
-    
-    query = f"""
-        UPDATE organizations 
-        SET {', '.join(update_fields)}
-        WHERE id = %s
-        RETURNING id, code, name, address, phone, email;
-    """
-    
-    with connection.cursor() as cur:
-        cur.execute(query, params)
-        result = cur.fetchone()
+    with db.get_connection() as connection, connection.cursor() as cur:
+        result = organizations_table.update(cur, org_id, code=code, name=name, address=address,
+                                            phone=phone, email=email)
+        if result:
+            _changed('organizations')
+            if name is not None:
+                # в списке курсов выводится название организации (в отчетах - нет)
+                _changed('courses', keys=())
         return result
 
+def bulk_update_organizations(rows):
+    """
+    Updates many organizations in one statement per set of changed columns;
+    `rows` are dicts with 'id' and the new values.
+    """
+    rows = list(rows)
+    result = _bulk_update(organizations_table, rows)
+    if result:
+        _changed('organizations')
+        if any(row.get('name') is not None for row in rows):
+            _changed('courses', keys=())
+    return result
+
+def delete_organizations(org_ids):
+    """
+    Deletes every organization that has no courses or teachers attached;
+    returns BatchDeleteResult(deleted, blocked, missing).
+    """
+    return _batch_delete('organizations', org_ids)
+
 def delete_organization(org_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
-            SELECT COUNT(*) FROM courses WHERE organization_id = %s;
-            """,
-            (org_id,))
-        course_count = cur.fetchone()[0]
-        
-        if course_count > 0:
-            return None
-            
-        cur.execute("""
-            DELETE FROM organizations 
-            WHERE id = %s 
-            RETURNING id, code, name;
-            """,
-            (org_id,))
-        result = cur.fetchone()
-        return result
+    result = delete_organizations([org_id])
+    return result.deleted[0] if result.deleted else None
 
 def add_course(code, name, type_id, training_days, max_students, base_price, organization_id, is_active=True):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO courses (code, name, type_id, training_days, max_students, base_price, organization_id, is_active)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -106,11 +231,12 @@ def add_course(code, name, type_id, training_days, max_students, base_price, org
             """,
             (code, name, type_id, training_days, max_students, base_price, organization_id, is_active))
         result = cur.fetchone()
+        if result:
+            _changed('courses', keys=[('organization', int(organization_id)), ('course', result[0])])
         return result
 
 def add_course_dates(training_request_id, start_date, end_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO course_dates (training_request_id, start_date, end_date)
             VALUES (%s, %s, %s)
@@ -118,11 +244,13 @@ def add_course_dates(training_request_id, start_date, end_date):
             """,
             (training_request_id, start_date, end_date))
         result = cur.fetchone()
+        if result:
+            _changed('course_dates')
         return result
 
+@idempotent
 def get_course_dates_by_request(training_request_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT id, start_date, end_date, created_at
             FROM course_dates 
@@ -134,38 +262,21 @@ def get_course_dates_by_request(training_request_id):
         return result
 
 def update_course_dates(course_dates_id, start_date=None, end_date=None):
-    connection = db.get_connection()
-    
-    update_fields = []
-    params = []
-    
-    if start_date is not None:
-        update_fields.append("start_date = %s")
-        params.append(start_date)
-    if end_date is not None:
-        update_fields.append("end_date = %s")
-        params.append(end_date)
-        
-    if not update_fields:
-        return None
-        
-    params.append(course_dates_id)
-    
-    query = f"""
-        UPDATE course_dates 
-        SET {', '.join(update_fields)}
-        WHERE id = %s
-        RETURNING id, start_date, end_date;
-    """
-    
-    with connection.cursor() as cur:
-        cur.execute(query, params)
-        result = cur.fetchone()
+    with db.get_connection() as connection, connection.cursor() as cur:
+        result = course_dates_table.update(cur, course_dates_id, start_date=start_date, end_date=end_date)
+        if result:
+            _changed('course_dates')
         return result
 
+def bulk_update_course_dates(rows):
+    result = _bulk_update(course_dates_table, rows)
+    if result:
+        _changed('course_dates')
+    return result
+
+@idempotent
 def get_course_dates_by_course(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT cd.id, cd.start_date, cd.end_date, 
                    tr.request_number, co.name as client_organization
@@ -179,24 +290,41 @@ def get_course_dates_by_course(course_id):
         result = cur.fetchall()
         return result
     
-def get_all_courses():
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ALL_COURSES_QUERY = """
             SELECT c.id, c.code, c.name, ct.name as type_name, c.training_days, 
                    c.max_students, c.base_price, c.vat_price, o.name as organization_name, c.is_active
             FROM courses c
             JOIN course_types ct ON c.type_id = ct.id
             JOIN organizations o ON c.organization_id = o.id
             ORDER BY c.id;
-            """)
+            """
+
+@reference_cache.cached('courses')
+@idempotent
+def get_all_courses():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(ALL_COURSES_QUERY)
         result = cur.fetchall()
         return result
 
-def get_course_by_id(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+COURSES_PAGE_QUERY = """
+            SELECT c.id, c.code, c.name, ct.name as type_name, c.training_days,
+                   c.max_students, c.base_price, c.vat_price, o.name as organization_name, c.is_active
+            FROM courses c
+            JOIN course_types ct ON c.type_id = ct.id
+            JOIN organizations o ON c.organization_id = o.id
+            {where}"""
+
+@idempotent
+def get_courses_page(after=None, before=None, limit=None):
+    sql, params, limit, backward = pagination.keyset_query(COURSES_PAGE_QUERY,
+        ['c.id'], [int], after=after, before=before, limit=limit)
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return pagination.build_page(rows, lambda row: (row[0],), limit, backward, bool(after or before))
+
+COURSE_BY_ID_QUERY = """
             SELECT c.id, c.code, c.name, c.type_id, c.training_days, c.max_students,
                    c.base_price, c.vat_price, c.organization_id, c.is_active,
                    ct.name as type_name, o.name as organization_name
@@ -204,180 +332,159 @@ def get_course_by_id(course_id):
             JOIN course_types ct ON c.type_id = ct.id
             JOIN organizations o ON c.organization_id = o.id
             WHERE c.id = %s;
-            """,
+            """
+COURSE_BY_ID = prepared.statement('course_by_id', COURSE_BY_ID_QUERY)
+
+@idempotent
+def get_course_by_id(course_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, COURSE_BY_ID,
             (course_id,))
         result = cur.fetchone()
         return result
 
+def _course_keys(courses, previous_organizations=()):
+    # Теги отчетов по курсам и их организациям, прежним и новым
+    keys = {('course', course[0]) for course in courses}
+    keys.update(('organization', course[3]) for course in courses)
+    keys.update(('organization', org_id) for org_id in previous_organizations)
+    return sorted(keys)
+
+def _course_organizations(cur, course_ids):
+    # прежняя организация нужна, чтобы сбросить и ее прайс-лист, если курс перенесли
+    cur.execute("SELECT organization_id FROM courses WHERE id = ANY(%s) FOR UPDATE;",
+                ([int(course_id) for course_id in course_ids],))
+    return [row[0] for row in cur.fetchall()]
+
 def update_course(course_id, code=None, name=None, type_id=None, training_days=None, 
                  max_students=None, base_price=None, organization_id=None, is_active=None):
-    connection = db.get_connection()
-    
-    update_fields = []
-    params = []
-    
-    if code is not None:
-        update_fields.append("code = %s")
-        params.append(code)
-    if name is not None:
-        update_fields.append("name = %s")
-        params.append(name)
-    if type_id is not None:
-        update_fields.append("type_id = %s")
-        params.append(type_id)
-    if training_days is not None:
-        update_fields.append("training_days = %s")
-        params.append(training_days)
-    if max_students is not None:
-        update_fields.append("max_students = %s")
-        params.append(max_students)
-    if base_price is not None:
-        update_fields.append("base_price = %s")
-        params.append(base_price)
-    if organization_id is not None:
-        update_fields.append("organization_id = %s")
-        params.append(organization_id)
-    if is_active is not None:
-        update_fields.append("is_active = %s")
-        params.append(is_active)
-        
-    if not update_fields:
-        return None
-        
-    params.append(course_id)
-    
-    query = f"""
-        UPDATE courses 
-        SET {', '.join(update_fields)}
-        WHERE id = %s
-        RETURNING id, code, name;
+    with db.transaction() as connection, connection.cursor() as cur:
+        previous = _course_organizations(cur, [course_id])
+        result = courses_table.update(cur, course_id, code=code, name=name, type_id=type_id,
+                                      training_days=training_days, max_students=max_students,
+                                      base_price=base_price, organization_id=organization_id,
+                                      is_active=is_active)
+    if result:
+        _changed('courses', keys=_course_keys([result], previous))
+    return result
+
+def bulk_update_courses(rows):
+    rows = list(rows)
+    with db.transaction() as connection, connection.cursor() as cur:
+        previous = _course_organizations(cur, [row['id'] for row in rows])
+        result = courses_table.bulk_update(cur, rows)
+    if result:
+        _changed('courses', keys=_course_keys(result, previous))
+    return result
+
+def delete_courses(course_ids):
     """
-    
-    with connection.cursor() as cur:
-        cur.execute(query, params)
-        result = cur.fetchone()
-        return result
+    Deletes every course without requests, assignments, prices, lead teacher
+    or tags; returns BatchDeleteResult(deleted, blocked, missing).
+    """
+    return _batch_delete('courses', course_ids, _course_keys)
 
 def delete_course(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        # Проверяем наличие зависимых записей одним запросом
-        cur.execute("""
-            SELECT 
-                (SELECT COUNT(*) FROM training_requests WHERE course_id = %s) as requests_count,
-                (SELECT COUNT(*) FROM teacher_assignments WHERE course_id = %s) as assignments_count,
-                (SELECT COUNT(*) FROM price_documents WHERE course_id = %s) as prices_count,
-                (SELECT COUNT(*) FROM course_lead_teacher WHERE course_id = %s) as lead_teachers_count,
-                (SELECT COUNT(*) FROM course_tag_relationship WHERE course_id = %s) as tags_count;
-            """,
-            (course_id, course_id, course_id, course_id, course_id))
-        
-        counts = cur.fetchone()
-        total_dependencies = sum(counts)
-        
-        if total_dependencies > 0:
-            print(f"Нельзя удалить курс: найдены зависимости - "
-                  f"заявки: {counts[0]}, назначения: {counts[1]}, "
-                  f"цены: {counts[2]}, ведущие преподаватели: {counts[3]}, "
-                  f"теги: {counts[4]}")
-            return None
+    result = delete_courses([course_id])
+    return result.deleted[0] if result.deleted else None
 
-        cur.execute("""
-            DELETE FROM courses 
-            WHERE id = %s 
-            RETURNING id, code, name;
-            """,
-            (course_id,))
-        result = cur.fetchone()
-        return result
-
-def get_courses_by_organization(org_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+COURSES_BY_ORGANIZATION_QUERY = """
             SELECT c.id, c.code, c.name, ct.name as type_name, c.training_days,
                    c.max_students, c.base_price, c.is_active
             FROM courses c
             JOIN course_types ct ON c.type_id = ct.id
             WHERE c.organization_id = %s
             ORDER BY c.name;
-            """,
+            """
+
+@idempotent
+def get_courses_by_organization(org_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(COURSES_BY_ORGANIZATION_QUERY,
             (org_id,))
         result = cur.fetchall()
         return result
 
-def search_organizations(search_term):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+@idempotent
+def search_organizations(search_term, limit=None, offset=0):
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT id, code, name, address, phone, email 
             FROM organizations 
-            WHERE name ILIKE %s OR code ILIKE %s
-            ORDER BY name;
+            WHERE name ILIKE %(pattern)s OR code ILIKE %(pattern)s
+            ORDER BY GREATEST(similarity(name, %(term)s), similarity(code, %(term)s)) DESC, name
+            LIMIT %(limit)s OFFSET %(offset)s;
             """,
-            (f'%{search_term}%', f'%{search_term}%'))
+            _search_params(search_term, limit, offset))
         result = cur.fetchall()
         return result
     
-def search_courses(search_term):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+@idempotent
+def search_courses(search_term, limit=None, offset=0):
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT c.id, c.code, c.name, ct.name as type_name, o.name as organization_name
             FROM courses c
             JOIN course_types ct ON c.type_id = ct.id
             JOIN organizations o ON c.organization_id = o.id
-            WHERE c.name ILIKE %s OR c.code ILIKE %s
-            ORDER BY c.name;
+            WHERE c.name ILIKE %(pattern)s OR c.code ILIKE %(pattern)s
+            ORDER BY GREATEST(similarity(c.name, %(term)s), similarity(c.code, %(term)s)) DESC, c.name
+            LIMIT %(limit)s OFFSET %(offset)s;
             """,
-            (f'%{search_term}%', f'%{search_term}%'))
+            _search_params(search_term, limit, offset))
         result = cur.fetchall()
         return result
 
 
 def add_price_document(document_number, document_date, price, course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO price_documents (document_number, document_date, price, course_id)
             VALUES (%s, %s, %s, %s)
-            RETURNING id, document_number, document_date, price;
+            RETURNING id, document_number, document_date, price,
+                (SELECT organization_id FROM courses WHERE id = course_id) as organization_id;
             """,
             (document_number, document_date, price, course_id))
         result = cur.fetchone()
+        if result:
+            _changed('price_documents', keys=[('organization', result[4])])
         return result
 
-def get_price_documents_by_course(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+PRICE_DOCUMENTS_BY_COURSE_QUERY = """
             SELECT id, document_number, document_date, price, created_at
             FROM price_documents 
             WHERE course_id = %s
             ORDER BY document_date DESC;
-            """,
+            """
+
+@idempotent
+def get_price_documents_by_course(course_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(PRICE_DOCUMENTS_BY_COURSE_QUERY,
             (course_id,))
         result = cur.fetchall()
         return result
 
-def get_current_price(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+CURRENT_PRICE_QUERY = """
             SELECT price, document_number, document_date
             FROM price_documents 
             WHERE course_id = %s
             ORDER BY document_date DESC
             LIMIT 1;
-            """,
+            """
+CURRENT_PRICE = prepared.statement('current_price', CURRENT_PRICE_QUERY)
+
+@idempotent
+def get_current_price(course_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, CURRENT_PRICE,
             (course_id,))
         result = cur.fetchone()
         return result
 
 
 def add_teacher(code, full_name, birth_date, gender=None, education=None, category=None):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO teachers (code, full_name, birth_date, gender, education, category)
             VALUES (%s, %s, %s, %s, %s, %s)
@@ -385,142 +492,176 @@ def add_teacher(code, full_name, birth_date, gender=None, education=None, catego
             """,
             (code, full_name, birth_date, gender, education, category))
         result = cur.fetchone()
+        if result:
+            # у нового преподавателя еще нет расписания - отчеты не сбрасываем
+            _changed('teachers', keys=())
         return result
 
-def get_all_teachers():
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ALL_TEACHERS_QUERY = """
             SELECT id, code, full_name, birth_date, gender, education, category
             FROM teachers 
             ORDER BY full_name;
-            """)
+            """
+
+@reference_cache.cached('teachers')
+@idempotent
+def get_all_teachers():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(ALL_TEACHERS_QUERY)
         result = cur.fetchall()
         return result
 
-def get_teacher_by_id(teacher_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+TEACHERS_PAGE_QUERY = """
+            SELECT id, code, full_name, birth_date, gender, education, category
+            FROM teachers
+            {where}"""
+
+@idempotent
+def get_teachers_page(after=None, before=None, limit=None):
+    sql, params, limit, backward = pagination.keyset_query(TEACHERS_PAGE_QUERY,
+        ['full_name', 'id'], [str, int], after=after, before=before, limit=limit)
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return pagination.build_page(rows, lambda row: (row[2], row[0]), limit, backward, bool(after or before))
+
+TEACHER_BY_ID_QUERY = """
             SELECT id, code, full_name, birth_date, gender, education, category
             FROM teachers 
             WHERE id = %s;
-            """,
+            """
+TEACHER_BY_ID = prepared.statement('teacher_by_id', TEACHER_BY_ID_QUERY)
+
+@idempotent
+def get_teacher_by_id(teacher_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, TEACHER_BY_ID,
             (teacher_id,))
         result = cur.fetchone()
         return result
 
 def update_teacher(teacher_id, code=None, full_name=None, birth_date=None, gender=None, education=None, category=None):
-    connection = db.get_connection()
-    
-    update_fields = []
-    params = []
-    
-    if code is not None:
-        update_fields.append("code = %s")
-        params.append(code)
-    if full_name is not None:
-        update_fields.append("full_name = %s")
-        params.append(full_name)
-    if birth_date is not None:
-        update_fields.append("birth_date = %s")
-        params.append(birth_date)
-    if gender is not None:
-        update_fields.append("gender = %s")
-        params.append(gender)
-    if education is not None:
-        update_fields.append("education = %s")
-        params.append(education)
-    if category is not None:
-        update_fields.append("category = %s")
-        params.append(category)
-        
-    if not update_fields:
-        return None
-        
-    params.append(teacher_id)
-    
-    query = f"""
-        UPDATE teachers 
-        SET {', '.join(update_fields)}
-        WHERE id = %s
-        RETURNING id, code, full_name;
-    """
-    
-    with connection.cursor() as cur:
-        cur.execute(query, params)
-        result = cur.fetchone()
+    with db.get_connection() as connection, connection.cursor() as cur:
+        result = teachers_table.update(cur, teacher_id, code=code, full_name=full_name, birth_date=birth_date,
+                                       gender=gender, education=education, category=category)
+        if result:
+            _changed('teachers', keys=[('teacher', result[0])])
         return result
 
+def bulk_update_teachers(rows):
+    result = _bulk_update(teachers_table, rows)
+    if result:
+        _changed('teachers', keys=[('teacher', row[0]) for row in result])
+    return result
+
+def delete_teachers(teacher_ids):
+    """
+    Deletes every teacher without assignments, lead-teacher roles or
+    organization links; returns BatchDeleteResult(deleted, blocked, missing).
+    """
+    return _batch_delete('teachers', teacher_ids)
+
 def delete_teacher(teacher_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        tables_to_check = [
-            "teacher_assignments",
-            "course_lead_teacher", 
-            "teacher_organization"
-        ]
-        
-        for table in tables_to_check:
-            if table == "teacher_assignments":
-                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE teacher_id = %s;", (teacher_id,))
-            elif table == "course_lead_teacher":
-                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE lead_teacher_id = %s;", (teacher_id,))
-            elif table == "teacher_organization":
-                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE teacher_id = %s;", (teacher_id,))
-            count = cur.fetchone()[0]
-            if count > 0:
-                return None
+    result = delete_teachers([teacher_id])
+    return result.deleted[0] if result.deleted else None
 
+@idempotent
+def search_teachers(search_term, limit=None, offset=0):
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
-            DELETE FROM teachers 
-            WHERE id = %s 
-            RETURNING id, code, full_name;
+            SELECT id, code, full_name, birth_date, gender, category
+            FROM teachers 
+            WHERE full_name ILIKE %(pattern)s OR code ILIKE %(pattern)s
+            ORDER BY GREATEST(similarity(full_name, %(term)s), similarity(code, %(term)s)) DESC, full_name
+            LIMIT %(limit)s OFFSET %(offset)s;
             """,
-            (teacher_id,))
-        result = cur.fetchone()
+            _search_params(search_term, limit, offset))
+        result = cur.fetchall()
         return result
 
-def search_teachers(search_term):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+@idempotent
+def search_all(search_term, limit=None, offset=0):
+    """
+    Ranked search over organizations, courses and teachers in one query.
+    Rows: (entity, id, code, title, rank).
+    """
+    params = _search_params(search_term, limit, offset)
+    params['branch_limit'] = params['limit'] + params['offset']
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
-            SELECT id, code, full_name, birth_date, gender, category
-            FROM teachers 
-            WHERE full_name ILIKE %s OR code ILIKE %s
-            ORDER BY full_name;
+            (SELECT 'organization' as entity, id, code, name as title,
+                    GREATEST(similarity(name, %(term)s), similarity(code, %(term)s)) as rank
+             FROM organizations
+             WHERE name ILIKE %(pattern)s OR code ILIKE %(pattern)s
+             ORDER BY rank DESC
+             LIMIT %(branch_limit)s)
+            UNION ALL
+            (SELECT 'course' as entity, id, code, name as title,
+                    GREATEST(similarity(name, %(term)s), similarity(code, %(term)s)) as rank
+             FROM courses
+             WHERE name ILIKE %(pattern)s OR code ILIKE %(pattern)s
+             ORDER BY rank DESC
+             LIMIT %(branch_limit)s)
+            UNION ALL
+            (SELECT 'teacher' as entity, id, code, full_name as title,
+                    GREATEST(similarity(full_name, %(term)s), similarity(code, %(term)s)) as rank
+             FROM teachers
+             WHERE full_name ILIKE %(pattern)s OR code ILIKE %(pattern)s
+             ORDER BY rank DESC
+             LIMIT %(branch_limit)s)
+            ORDER BY rank DESC, title
+            LIMIT %(limit)s OFFSET %(offset)s;
             """,
-            (f'%{search_term}%', f'%{search_term}%'))
+            params)
         result = cur.fetchall()
         return result
 
 def add_training_request_with_dates(request_number, client_organization_id, course_id, 
-                                  required_deadline, total_students, start_date, end_date, status='новая'):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+                                  required_deadline, total_students, start_date=None, end_date=None, status='новая'):
+    """
+    Creates a training request and its course dates with one data-modifying
+    CTE, so both rows are written in a single round-trip or not at all.
+    Returns (id, request_number, request_date, status, course_dates_id);
+    course_dates_id is None when no dates are given.
+    """
+    if (start_date is None) != (end_date is None):
+        raise ValueError('start_date and end_date must be given together')
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
-            INSERT INTO training_requests (request_number, client_organization_id, course_id, 
-                                         required_deadline, total_students, status)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id, request_number, request_date, status;
-            """,
-            (request_number, client_organization_id, course_id, required_deadline, total_students, status))
-        request_result = cur.fetchone()
-        
-        if request_result:
-            cur.execute("""
+            WITH new_request AS (
+                INSERT INTO training_requests (request_number, client_organization_id, course_id, 
+                                             required_deadline, total_students, status)
+                VALUES (%(request_number)s, %(client_organization_id)s, %(course_id)s,
+                        %(required_deadline)s, %(total_students)s, %(status)s)
+                RETURNING id, request_number, request_date, status
+            ),
+            new_dates AS (
                 INSERT INTO course_dates (training_request_id, start_date, end_date)
-                VALUES (%s, %s, %s)
-                RETURNING id;
-                """,
-                (request_result[0], start_date, end_date))
-        
-        return request_result
+                SELECT id, %(start_date)s, %(end_date)s
+                FROM new_request
+                WHERE %(start_date)s::date IS NOT NULL
+                RETURNING id
+            )
+            SELECT r.id, r.request_number, r.request_date, r.status, d.id
+            FROM new_request r
+            LEFT JOIN new_dates d ON true;
+            """,
+            {
+                'request_number': request_number,
+                'client_organization_id': client_organization_id,
+                'course_id': course_id,
+                'required_deadline': required_deadline,
+                'total_students': total_students,
+                'status': status,
+                'start_date': start_date,
+                'end_date': end_date,
+            })
+        result = cur.fetchone()
+        if result:
+            _changed('training_requests', 'course_dates', keys=[('course', int(course_id))])
+        return result
 
-def get_all_training_requests():
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ALL_TRAINING_REQUESTS_QUERY = """
             SELECT tr.id, tr.request_number, tr.request_date, 
                    co.name as client_org, c.name as course_name,
                    tr.required_deadline, tr.total_students, tr.status
@@ -528,14 +669,37 @@ def get_all_training_requests():
             JOIN client_organizations co ON tr.client_organization_id = co.id
             JOIN courses c ON tr.course_id = c.id
             ORDER BY tr.request_date DESC;
-            """)
+            """
+
+@idempotent
+def get_all_training_requests():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(ALL_TRAINING_REQUESTS_QUERY)
         result = cur.fetchall()
         return result
 
-def get_training_request_by_id(request_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+def iter_all_training_requests(itersize=None):
+    return _iter_query(ALL_TRAINING_REQUESTS_QUERY, (), itersize)
+
+TRAINING_REQUESTS_PAGE_QUERY = """
+            SELECT tr.id, tr.request_number, tr.request_date,
+                   co.name as client_org, c.name as course_name,
+                   tr.required_deadline, tr.total_students, tr.status
+            FROM training_requests tr
+            JOIN client_organizations co ON tr.client_organization_id = co.id
+            JOIN courses c ON tr.course_id = c.id
+            {where}"""
+
+@idempotent
+def get_training_requests_page(after=None, before=None, limit=None):
+    sql, params, limit, backward = pagination.keyset_query(TRAINING_REQUESTS_PAGE_QUERY,
+        ['tr.request_date', 'tr.id'], [date, int], descending=True, after=after, before=before, limit=limit)
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return pagination.build_page(rows, lambda row: (row[2], row[0]), limit, backward, bool(after or before))
+
+TRAINING_REQUEST_BY_ID_QUERY = """
             SELECT tr.id, tr.request_number, tr.request_date, 
                    tr.client_organization_id, tr.course_id, tr.required_deadline,
                    tr.total_students, tr.status,
@@ -546,58 +710,39 @@ def get_training_request_by_id(request_id):
             JOIN courses c ON tr.course_id = c.id
             LEFT JOIN course_dates cd ON tr.id = cd.training_request_id
             WHERE tr.id = %s;
-            """,
+            """
+TRAINING_REQUEST_BY_ID = prepared.statement('training_request_by_id', TRAINING_REQUEST_BY_ID_QUERY)
+
+@idempotent
+def get_training_request_by_id(request_id):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, TRAINING_REQUEST_BY_ID,
             (request_id,))
         result = cur.fetchone()
         return result
 
 def update_training_request(request_id, request_number=None, client_organization_id=None, course_id=None, 
                           required_deadline=None, total_students=None, status=None):
-    connection = db.get_connection()
-    
-    update_fields = []
-    params = []
-    
-    if request_number is not None:
-        update_fields.append("request_number = %s")
-        params.append(request_number)
-    if client_organization_id is not None:
-        update_fields.append("client_organization_id = %s")
-        params.append(client_organization_id)
-    if course_id is not None:
-        update_fields.append("course_id = %s")
-        params.append(course_id)
-    if required_deadline is not None:
-        update_fields.append("required_deadline = %s")
-        params.append(required_deadline)
-    if total_students is not None:
-        update_fields.append("total_students = %s")
-        params.append(total_students)
-    if status is not None:
-        update_fields.append("status = %s")
-        params.append(status)
-        
-    if not update_fields:
-        return None
-        
-    params.append(request_id)
-    
-    query = f"""
-        UPDATE training_requests 
-        SET {', '.join(update_fields)}
-        WHERE id = %s
-        RETURNING id, request_number, status;
-    """
-    
-    with connection.cursor() as cur:
-        cur.execute(query, params)
-        result = cur.fetchone()
-        return result
+    with db.transaction() as connection, connection.cursor() as cur:
+        # прежний курс нужен, чтобы сбросить отчеты и по нему, если заявку перенесли
+        cur.execute("SELECT course_id FROM training_requests WHERE id = %s FOR UPDATE;", (request_id,))
+        previous = cur.fetchone()
+        result = training_requests_table.update(cur, request_id, request_number=request_number,
+                                                client_organization_id=client_organization_id,
+                                                course_id=course_id, required_deadline=required_deadline,
+                                                total_students=total_students, status=status)
+    if result:
+        course_ids = {previous[0]} if course_id is None else {previous[0], int(course_id)}
+        _changed('training_requests', keys=[('course', c) for c in course_ids])
+    return result
 
-def get_training_requests_by_status(status):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+def bulk_update_training_requests(rows):
+    result = _bulk_update(training_requests_table, rows)
+    if result:
+        _changed('training_requests')
+    return result
+
+TRAINING_REQUESTS_BY_STATUS_QUERY = """
             SELECT tr.id, tr.request_number, tr.request_date, 
                    co.name as client_org, c.name as course_name,
                    tr.total_students
@@ -606,15 +751,19 @@ def get_training_requests_by_status(status):
             JOIN courses c ON tr.course_id = c.id
             WHERE tr.status = %s
             ORDER BY tr.request_date;
-            """,
+            """
+
+@idempotent
+def get_training_requests_by_status(status):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(TRAINING_REQUESTS_BY_STATUS_QUERY,
             (status,))
         result = cur.fetchall()
         return result
 
 
 def add_client_organization(name, address, phone=None, email=None):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO client_organizations (name, address, phone, email)
             VALUES (%s, %s, %s, %s)
@@ -622,24 +771,26 @@ def add_client_organization(name, address, phone=None, email=None):
             """,
             (name, address, phone, email))
         result = cur.fetchone()
+        if result:
+            _changed('client_organizations')
         return result
 
-def get_all_client_organizations():
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ALL_CLIENT_ORGANIZATIONS_QUERY = """
             SELECT id, name, address, phone, email
             FROM client_organizations 
             ORDER BY name;
-            """)
+            """
+
+@reference_cache.cached('client_organizations')
+@idempotent
+def get_all_client_organizations():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute(ALL_CLIENT_ORGANIZATIONS_QUERY)
         result = cur.fetchall()
         return result
 
 
-def get_organization_price_list(org_id, target_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+ORGANIZATION_PRICE_LIST_QUERY = """
             SELECT 
                 c.code as course_code,
                 c.name as course_name,
@@ -651,23 +802,79 @@ def get_organization_price_list(org_id, target_date):
                 pd.document_date
             FROM courses c
             JOIN course_types ct ON c.type_id = ct.id
-            LEFT JOIN price_documents pd ON c.id = pd.course_id 
-                AND pd.document_date = (
-                    SELECT MAX(document_date) 
-                    FROM price_documents 
-                    WHERE course_id = c.id AND document_date <= %s
-                )
+            LEFT JOIN LATERAL (
+                -- одна упорядоченная выборка по индексу (course_id, document_date)
+                SELECT p.price, p.document_number, p.document_date
+                FROM price_documents p
+                WHERE p.course_id = c.id AND p.document_date <= %s
+                ORDER BY p.document_date DESC, p.id DESC
+                LIMIT 1
+            ) pd ON true
             WHERE c.organization_id = %s AND c.is_active = true
             ORDER BY c.name;
-            """,
+            """
+ORGANIZATION_PRICE_LIST = prepared.statement('organization_price_list', ORGANIZATION_PRICE_LIST_QUERY)
+
+@report_cache.memoize('price_list', _price_list_tags)
+@idempotent
+def get_organization_price_list(org_id, target_date, columnar=False):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, ORGANIZATION_PRICE_LIST,
             (target_date, org_id))
-        result = cur.fetchall()
+        result = rows.fetch_columns(cur) if columnar else cur.fetchall()
         return result
 
-def get_teacher_schedule(teacher_id, start_date, end_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+def iter_organization_price_list(org_id, target_date, itersize=None):
+    return _iter_query(ORGANIZATION_PRICE_LIST_QUERY, (target_date, org_id), itersize)
+
+ORGANIZATION_PRICE_LISTS_QUERY = """
+            SELECT 
+                o.org_id,
+                d.target_date,
+                c.code as course_code,
+                c.name as course_name,
+                ct.name as course_type,
+                c.training_days,
+                COALESCE(pd.price, c.base_price) as current_price,
+                COALESCE(pd.price, c.base_price) * 1.2 as price_with_vat,
+                pd.document_number,
+                pd.document_date
+            FROM unnest(%s::int[]) AS o(org_id)
+            CROSS JOIN unnest(%s::date[]) AS d(target_date)
+            JOIN courses c ON c.organization_id = o.org_id AND c.is_active = true
+            JOIN course_types ct ON c.type_id = ct.id
+            LEFT JOIN LATERAL (
+                SELECT p.price, p.document_number, p.document_date
+                FROM price_documents p
+                WHERE p.course_id = c.id AND p.document_date <= d.target_date
+                ORDER BY p.document_date DESC, p.id DESC
+                LIMIT 1
+            ) pd ON true
+            ORDER BY o.org_id, d.target_date, c.name;
+            """
+ORGANIZATION_PRICE_LISTS = prepared.statement('organization_price_lists', ORGANIZATION_PRICE_LISTS_QUERY)
+
+@idempotent
+def get_organization_price_lists(org_ids, target_dates):
+    """
+    Builds price lists for every (organization, date) combination in one query.
+    Returns {(org_id, target_date): rows}, rows shaped like get_organization_price_list.
+    """
+    org_ids = [int(org_id) for org_id in org_ids]
+    target_dates = [d if isinstance(d, date) else date.fromisoformat(d) for d in target_dates]
+    price_lists = {(org_id, target_date): [] for org_id in org_ids for target_date in target_dates}
+    if not price_lists:
+        return price_lists
+
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, ORGANIZATION_PRICE_LISTS,
+            (org_ids, target_dates))
+        price_row = rows.record_class(rows.column_names(cur.description)[2:])
+        for row in cur:
+            price_lists[(row[0], row[1])].append(price_row._make(row[2:]))
+        return price_lists
+
+TEACHER_SCHEDULE_QUERY = """
             SELECT 
                 c.name as course_name,
                 ta.start_date,
@@ -681,34 +888,98 @@ def get_teacher_schedule(teacher_id, start_date, end_date):
             WHERE ta.teacher_id = %s 
                 AND s.lesson_date BETWEEN %s AND %s
             ORDER BY s.lesson_date, s.start_time;
-            """,
+            """
+TEACHER_SCHEDULE = prepared.statement('teacher_schedule', TEACHER_SCHEDULE_QUERY)
+
+@report_cache.memoize('teacher_schedule', _teacher_schedule_tags)
+@idempotent
+def get_teacher_schedule(teacher_id, start_date, end_date, columnar=False):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, TEACHER_SCHEDULE,
             (teacher_id, start_date, end_date))
-        result = cur.fetchall()
+        result = rows.fetch_columns(cur) if columnar else cur.fetchall()
         return result
 
-def get_course_group_filling(course_id, start_date, end_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("SELECT max_students FROM courses WHERE id = %s;", (course_id,))
-        max_students = cur.fetchone()[0]
-        
-        cur.execute("""
+def iter_teacher_schedule(teacher_id, start_date, end_date, itersize=None):
+    return _iter_query(TEACHER_SCHEDULE_QUERY, (teacher_id, start_date, end_date), itersize)
+
+TEACHERS_SCHEDULE_QUERY = """
             SELECT 
-                COUNT(*) as total_groups,
-                SUM(tr.total_students) as total_students,
-                COUNT(CASE WHEN tr.total_students >= c.max_students THEN 1 END) as full_groups,
-                COUNT(CASE WHEN tr.total_students < c.max_students THEN 1 END) as not_full_groups
-            FROM training_requests tr
-            JOIN courses c ON tr.course_id = c.id
-            WHERE tr.course_id = %s 
-                AND tr.request_date BETWEEN %s AND %s
-                AND tr.status IN ('подтверждена', 'завершена');
-            """,
-            (course_id, start_date, end_date))
-        group_stats = cur.fetchone()
-        
+                ta.teacher_id,
+                t.full_name as teacher_name,
+                c.name as course_name,
+                ta.start_date,
+                ta.end_date,
+                s.lesson_date,
+                s.start_time,
+                s.end_time,
+                s.id as lesson_id
+            FROM teacher_assignments ta
+            JOIN teachers t ON ta.teacher_id = t.id
+            JOIN courses c ON ta.course_id = c.id
+            JOIN schedule s ON ta.id = s.teacher_assignment_id
+            WHERE ta.teacher_id = ANY(%s)
+                AND s.lesson_date BETWEEN %s AND %s
+            ORDER BY t.full_name, ta.teacher_id, s.lesson_date, s.start_time;
+            """
+TEACHERS_SCHEDULE = prepared.statement('teachers_schedule', TEACHERS_SCHEDULE_QUERY)
+
+@report_cache.memoize('teachers_schedule', _teacher_schedule_tags)
+@idempotent
+def get_teachers_schedule(teacher_ids, start_date, end_date, columnar=False):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, TEACHERS_SCHEDULE,
+            ([int(teacher_id) for teacher_id in teacher_ids], start_date, end_date))
+        result = rows.fetch_columns(cur) if columnar else cur.fetchall()
+        return result
+
+TEACHERS_LESSONS_SUMMARY_QUERY = """
+            SELECT 
+                l.teacher_id,
+                COUNT(*) FILTER (WHERE l.lessons > 0) as lesson_days,
+                SUM(l.lessons) as lessons,
+                SUM(l.minutes) as minutes
+            FROM teacher_lessons_daily l
+            WHERE l.teacher_id = ANY(%s)
+                AND l.day BETWEEN %s AND %s
+            GROUP BY l.teacher_id;
+            """
+TEACHERS_LESSONS_SUMMARY = prepared.statement('teachers_lessons_summary', TEACHERS_LESSONS_SUMMARY_QUERY)
+
+@report_cache.memoize('teachers_lessons_summary', _teacher_schedule_tags)
+@idempotent
+def get_teachers_lessons_summary(teacher_ids, start_date, end_date):
+    """
+    Lesson days, lessons and minutes per teacher over the period, read from
+    the teacher_lessons_daily rollup. Returns {teacher_id: row}.
+    """
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, TEACHERS_LESSONS_SUMMARY,
+            ([int(teacher_id) for teacher_id in teacher_ids], start_date, end_date))
+        return {row[0]: row for row in cur.fetchall()}
+
+@idempotent
+def get_teachers_by_ids(teacher_ids):
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
+            SELECT id, code, full_name, birth_date, gender, education, category
+            FROM teachers 
+            WHERE id = ANY(%s)
+            ORDER BY full_name;
+            """,
+            ([int(teacher_id) for teacher_id in teacher_ids],))
+        result = cur.fetchall()
+        return result
+
+GROUP_FILLING_QUERY = """
             SELECT 
+                c.id as course_id,
+                c.max_students,
+                t.total_groups,
+                t.total_students,
+                t.full_groups,
+                t.total_groups - t.full_groups as not_full_groups,
+                tr.id as request_id,
                 tr.request_number,
                 tr.request_date,
                 tr.total_students,
@@ -718,29 +989,84 @@ def get_course_group_filling(course_id, start_date, end_date):
                     ELSE 'Не полностью набрана'
                 END as filling_status,
                 ROUND((tr.total_students::decimal / c.max_students) * 100, 2) as filling_percentage
-            FROM training_requests tr
-            JOIN courses c ON tr.course_id = c.id
-            WHERE tr.course_id = %s 
+            FROM courses c
+            CROSS JOIN LATERAL (
+                -- итоги берем из дневной сводки, а не агрегируем заявки
+                SELECT COALESCE(SUM(f.groups), 0) as total_groups,
+                       COALESCE(SUM(f.students), 0) as total_students,
+                       COALESCE(SUM(f.full_groups), 0) as full_groups
+                FROM course_filling_daily f
+                WHERE f.course_id = c.id AND f.day BETWEEN %s AND %s
+            ) t
+            LEFT JOIN training_requests tr ON tr.course_id = c.id
                 AND tr.request_date BETWEEN %s AND %s
                 AND tr.status IN ('подтверждена', 'завершена')
-            ORDER BY tr.request_date;
-            """,
-            (course_id, start_date, end_date))
-        group_details = cur.fetchall()
-        
-        return {
-            'max_students': max_students,
-            'total_groups': group_stats[0],
-            'total_students': group_stats[1],
-            'full_groups': group_stats[2],
-            'not_full_groups': group_stats[3],
-            'group_details': group_details
-        }
-
-def get_course_schedule(course_id, start_date, end_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
-        cur.execute("""
+            WHERE {course_filter}
+            ORDER BY c.id, tr.request_date;
+            """
+
+# Колонки заявки в строке GROUP_FILLING_QUERY начиная с request_number;
+# total_students там повторяется, поэтому имена задаем явно
+GroupDetail = rows.record_class(('request_number', 'request_date', 'total_students', 'status',
+                                 'filling_status', 'filling_percentage'))
+
+def _group_filling_by_course(rows):
+    # Агрегаты повторяются в каждой строке окна - берем их из первой строки курса
+    filling = {}
+    for row in rows:
+        course_filling = filling.get(row[0])
+        if course_filling is None:
+            course_filling = filling[row[0]] = {
+                'max_students': row[1],
+                'total_groups': row[2],
+                'total_students': row[3],
+                'full_groups': row[4],
+                'not_full_groups': row[5],
+                'group_details': []
+            }
+        if row[6] is not None:
+            course_filling['group_details'].append(GroupDetail._make(row[7:]))
+    return filling
+
+def _group_filling_filter(course_ids, organization_id):
+    if course_ids is not None:
+        return 'c.id = ANY(%s)', [int(course_id) for course_id in course_ids]
+    if organization_id is not None:
+        return 'c.organization_id = %s', organization_id
+    raise ValueError('Either course_ids or organization_id is required')
+
+GROUP_FILLING = {
+    course_filter: prepared.statement(name, GROUP_FILLING_QUERY.format(course_filter=course_filter))
+    for name, course_filter in [
+        ('group_filling_course', 'c.id = %s'),
+        ('group_filling_courses', 'c.id = ANY(%s)'),
+        ('group_filling_organization', 'c.organization_id = %s'),
+    ]
+}
+
+@report_cache.memoize('group_filling', _group_filling_tags)
+@idempotent
+def get_course_group_filling(course_id, start_date, end_date):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, GROUP_FILLING['c.id = %s'],
+            (start_date, end_date, start_date, end_date, course_id))
+        rows = cur.fetchall()
+    return next(iter(_group_filling_by_course(rows).values()), None)
+
+@idempotent
+def get_courses_group_filling(start_date, end_date, course_ids=None, organization_id=None):
+    """
+    Group filling for several courses at once: either the given course ids or
+    every course of an organization. Returns {course_id: filling}.
+    """
+    course_filter, course_param = _group_filling_filter(course_ids, organization_id)
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, GROUP_FILLING[course_filter],
+            (start_date, end_date, start_date, end_date, course_param))
+        rows = cur.fetchall()
+    return _group_filling_by_course(rows)
+
+COURSE_SCHEDULE_QUERY = """
             SELECT 
                 s.lesson_date,
                 s.start_time,
@@ -752,14 +1078,20 @@ def get_course_schedule(course_id, start_date, end_date):
             WHERE ta.course_id = %s 
                 AND s.lesson_date BETWEEN %s AND %s
             ORDER BY s.lesson_date, s.start_time;
-            """,
+            """
+COURSE_SCHEDULE = prepared.statement('course_schedule', COURSE_SCHEDULE_QUERY)
+
+@idempotent
+def get_course_schedule(course_id, start_date, end_date, columnar=False):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        prepared.execute(cur, COURSE_SCHEDULE,
             (course_id, start_date, end_date))
-        result = cur.fetchall()
+        result = rows.fetch_columns(cur) if columnar else cur.fetchall()
         return result
 
+@idempotent
 def get_teacher_courses(teacher_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT DISTINCT
                 c.id,
@@ -778,8 +1110,7 @@ def get_teacher_courses(teacher_id):
         return result
 
 def add_teacher_assignment(document_number, document_date, teacher_id, course_id, start_date, end_date):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO teacher_assignments (document_number, document_date, teacher_id, course_id, start_date, end_date)
             VALUES (%s, %s, %s, %s, %s, %s)
@@ -787,11 +1118,13 @@ def add_teacher_assignment(document_number, document_date, teacher_id, course_id
             """,
             (document_number, document_date, teacher_id, course_id, start_date, end_date))
         result = cur.fetchone()
+        if result:
+            _changed('teacher_assignments', keys=[('teacher', int(teacher_id))])
         return result
 
+@idempotent
 def get_teacher_assignments(teacher_id=None, course_id=None):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         query = """
             SELECT ta.id, ta.document_number, ta.document_date, 
                    t.full_name as teacher_name, c.name as course_name,
@@ -818,8 +1151,7 @@ def get_teacher_assignments(teacher_id=None, course_id=None):
         return result
 
 def set_course_lead_teacher(course_id, lead_teacher_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("DELETE FROM course_lead_teacher WHERE course_id = %s;", (course_id,))
         
         cur.execute("""
@@ -829,11 +1161,13 @@ def set_course_lead_teacher(course_id, lead_teacher_id):
             """,
             (course_id, lead_teacher_id))
         result = cur.fetchone()
+        if result:
+            _changed('course_lead_teacher')
         return result
 
+@idempotent
 def get_course_lead_teacher(course_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT clt.id, clt.course_id, clt.lead_teacher_id, clt.assigned_date,
                    t.full_name as teacher_name, t.code as teacher_code
@@ -846,20 +1180,22 @@ def get_course_lead_teacher(course_id):
         return result
 
 def add_schedule_entry(teacher_assignment_id, lesson_date, start_time, end_time):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             INSERT INTO schedule (teacher_assignment_id, lesson_date, start_time, end_time)
             VALUES (%s, %s, %s, %s)
-            RETURNING id, lesson_date, start_time, end_time;
+            RETURNING id, lesson_date, start_time, end_time,
+                (SELECT teacher_id FROM teacher_assignments WHERE id = teacher_assignment_id) as teacher_id;
             """,
             (teacher_assignment_id, lesson_date, start_time, end_time))
         result = cur.fetchone()
+        if result:
+            _changed('schedule', keys=[('teacher', result[4])])
         return result
 
+@idempotent
 def get_schedule_by_assignment(teacher_assignment_id):
-    connection = db.get_connection()
-    with connection.cursor() as cur:
+    with db.get_connection() as connection, connection.cursor() as cur:
         cur.execute("""
             SELECT id, lesson_date, start_time, end_time
             FROM schedule 
@@ -869,3 +1205,59 @@ def get_schedule_by_assignment(teacher_assignment_id):
             (teacher_assignment_id,))
         result = cur.fetchall()
         return result
+
+DASHBOARD_ESTIMATE_QUERY = """
+            WITH est AS (
+                SELECT c.oid::regclass::text AS table_name, c.reltuples::bigint AS row_estimate
+                FROM pg_class c
+                WHERE c.oid IN ('organizations'::regclass, 'courses'::regclass,
+                                'teachers'::regclass, 'training_requests'::regclass)
+            )
+            SELECT
+                CASE WHEN (SELECT row_estimate FROM est WHERE table_name = 'organizations') >= %(threshold)s
+                     THEN (SELECT row_estimate FROM est WHERE table_name = 'organizations')
+                     ELSE (SELECT COUNT(*) FROM organizations) END,
+                CASE WHEN (SELECT row_estimate FROM est WHERE table_name = 'courses') >= %(threshold)s
+                     THEN (SELECT row_estimate FROM est WHERE table_name = 'courses')
+                     ELSE (SELECT COUNT(*) FROM courses) END,
+                CASE WHEN (SELECT row_estimate FROM est WHERE table_name = 'teachers') >= %(threshold)s
+                     THEN (SELECT row_estimate FROM est WHERE table_name = 'teachers')
+                     ELSE (SELECT COUNT(*) FROM teachers) END,
+                CASE WHEN (SELECT row_estimate FROM est WHERE table_name = 'training_requests') >= %(threshold)s
+                     THEN (SELECT row_estimate FROM est WHERE table_name = 'training_requests')
+                     ELSE (SELECT COUNT(*) FROM training_requests) END;
+            """
+
+DASHBOARD_COUNT_QUERY = """
+            SELECT
+                (SELECT COUNT(*) FROM organizations),
+                (SELECT COUNT(*) FROM courses),
+                (SELECT COUNT(*) FROM teachers),
+                (SELECT COUNT(*) FROM training_requests);
+            """
+
+@idempotent
+def _count_dashboard_rows(estimate):
+    with db.get_connection() as connection, connection.cursor() as cur:
+        if estimate:
+            # Для больших таблиц берем оценку планировщика, для маленьких - точный COUNT(*)
+            cur.execute(DASHBOARD_ESTIMATE_QUERY,
+                {'threshold': settings.DASHBOARD_STATS_ESTIMATE_THRESHOLD})
+        else:
+            cur.execute(DASHBOARD_COUNT_QUERY)
+        result = cur.fetchone()
+        return result
+
+def _dashboard_stats(counts):
+    return {
+        'organizations_count': counts[0],
+        'courses_count': counts[1],
+        'teachers_count': counts[2],
+        'requests_count': counts[3]
+    }
+
+def get_dashboard_stats(estimate=None):
+    if estimate is None:
+        estimate = settings.DASHBOARD_STATS_ESTIMATE
+    return dashboard_stats_cache.get_or_set(('dashboard', estimate),
+                                            lambda: _dashboard_stats(_count_dashboard_rows(estimate)))
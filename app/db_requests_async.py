@@ -0,0 +1,278 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from datetime import date
+
+from psycopg_pool import AsyncConnectionPool
+
+import pagination
+import rows
+from config import settings
+from db_conn import instance_name
+from db_requests import (
+    ALL_CLIENT_ORGANIZATIONS_QUERY, ALL_COURSES_QUERY, ALL_ORGANIZATIONS_QUERY, ALL_TEACHERS_QUERY,
+    ALL_TRAINING_REQUESTS_QUERY, COURSE_BY_ID_QUERY, COURSE_SCHEDULE_QUERY, COURSES_BY_ORGANIZATION_QUERY,
+    COURSES_PAGE_QUERY, CURRENT_PRICE_QUERY, DASHBOARD_COUNT_QUERY, DASHBOARD_ESTIMATE_QUERY, GROUP_FILLING_QUERY,
+    ORGANIZATION_BY_ID_QUERY, ORGANIZATION_PRICE_LIST_QUERY, ORGANIZATION_PRICE_LISTS_QUERY,
+    ORGANIZATIONS_PAGE_QUERY, PRICE_DOCUMENTS_BY_COURSE_QUERY, TEACHER_BY_ID_QUERY, TEACHER_SCHEDULE_QUERY,
+    TEACHERS_LESSONS_SUMMARY_QUERY, TEACHERS_PAGE_QUERY, TEACHERS_SCHEDULE_QUERY,
+    TRAINING_REQUEST_BY_ID_QUERY, TRAINING_REQUESTS_BY_STATUS_QUERY, TRAINING_REQUESTS_PAGE_QUERY,
+    _dashboard_stats, _group_filling_by_course, _group_filling_filter, _group_filling_tags, _price_list_tags,
+    _teacher_schedule_tags, dashboard_stats_cache, reference_cache, report_cache,
+)
+
+
+def _record_row(cursor):
+    # те же записи rows.record_class, что и у rows.RecordCursor: кэши общие с db_requests
+    if cursor.description is None:
+        return tuple
+    return rows.record_class(rows.column_names(cursor.description))._make
+
+
+class AsyncDBConnect:
+    """
+    Async counterpart of db_conn.DBConnect on psycopg 3 with its own pool
+    (DB_ASYNC_POOL_MIN..DB_ASYNC_POOL_MAX connections). The pool is opened
+    lazily on the event loop that first uses it and must stay on that loop.
+    """
+
+    def __init__(self, host, dbname, user, password, port=5432,
+                 pool_min=1, pool_max=10, pool_timeout=30.0, health_check='idle'):
+        self.pool = AsyncConnectionPool(
+            kwargs={
+                'host': host,
+                'dbname': dbname,
+                'user': user,
+                'password': password,
+                'port': port,
+                'application_name': instance_name(),
+                'autocommit': True,
+                'row_factory': _record_row,
+            },
+            min_size=pool_min,
+            max_size=pool_max,
+            timeout=pool_timeout,
+            check=None if health_check == 'never' else AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        self._opened = False
+        self._open_lock = None
+
+    async def open(self):
+        if self._opened:
+            return
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if not self._opened:
+                await self.pool.open()
+                self._opened = True
+
+    @asynccontextmanager
+    async def get_connection(self, timeout=None):
+        await self.open()
+        async with self.pool.connection(timeout) as connection:
+            yield connection
+
+    async def close(self):
+        if self._opened:
+            await self.pool.close()
+            self._opened = False
+
+    def pool_stats(self):
+        return self.pool.get_stats()
+
+
+adb = AsyncDBConnect(
+    host=settings.DB_HOST,
+    dbname=settings.DB_NAME,
+    user=settings.DB_USER,
+    password=settings.DB_PASSWORD,
+    port=settings.DB_PORT,
+    pool_min=settings.DB_ASYNC_POOL_MIN,
+    pool_max=settings.DB_ASYNC_POOL_MAX,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    health_check=settings.DB_HEALTH_CHECK,
+)
+
+
+async def _fetchall(query, params=None):
+    async with adb.get_connection() as connection, connection.cursor() as cur:
+        await cur.execute(query, params)
+        return await cur.fetchall()
+
+
+async def _fetchone(query, params=None):
+    async with adb.get_connection() as connection, connection.cursor() as cur:
+        await cur.execute(query, params)
+        return await cur.fetchone()
+
+
+async def _fetch_page(query, key_columns, key_types, key_of, after, before, limit, descending=False):
+    sql, params, limit, backward = pagination.keyset_query(query, key_columns, key_types, descending=descending,
+                                                           after=after, before=before, limit=limit)
+    rows = await _fetchall(sql, params)
+    return pagination.build_page(rows, key_of, limit, backward, bool(after or before))
+
+
+# --- Списки ---
+# Справочники и отчеты берутся из тех же кэшей и под теми же ключами, что и в db_requests
+
+@reference_cache.cached('organizations')
+async def get_all_organizations():
+    return await _fetchall(ALL_ORGANIZATIONS_QUERY)
+
+async def get_organizations_page(after=None, before=None, limit=None):
+    return await _fetch_page(ORGANIZATIONS_PAGE_QUERY, ['id'], [int], lambda row: (row[0],), after, before, limit)
+
+@reference_cache.cached('courses')
+async def get_all_courses():
+    return await _fetchall(ALL_COURSES_QUERY)
+
+async def get_courses_page(after=None, before=None, limit=None):
+    return await _fetch_page(COURSES_PAGE_QUERY, ['c.id'], [int], lambda row: (row[0],), after, before, limit)
+
+async def get_courses_by_organization(org_id):
+    return await _fetchall(COURSES_BY_ORGANIZATION_QUERY, (org_id,))
+
+async def get_price_documents_by_course(course_id):
+    return await _fetchall(PRICE_DOCUMENTS_BY_COURSE_QUERY, (course_id,))
+
+@reference_cache.cached('teachers')
+async def get_all_teachers():
+    return await _fetchall(ALL_TEACHERS_QUERY)
+
+async def get_teachers_page(after=None, before=None, limit=None):
+    return await _fetch_page(TEACHERS_PAGE_QUERY, ['full_name', 'id'], [str, int], lambda row: (row[2], row[0]),
+                             after, before, limit)
+
+async def get_all_training_requests():
+    return await _fetchall(ALL_TRAINING_REQUESTS_QUERY)
+
+async def get_training_requests_page(after=None, before=None, limit=None):
+    return await _fetch_page(TRAINING_REQUESTS_PAGE_QUERY, ['tr.request_date', 'tr.id'], [date, int],
+                             lambda row: (row[2], row[0]), after, before, limit, descending=True)
+
+async def get_training_requests_by_status(status):
+    return await _fetchall(TRAINING_REQUESTS_BY_STATUS_QUERY, (status,))
+
+@reference_cache.cached('client_organizations')
+async def get_all_client_organizations():
+    return await _fetchall(ALL_CLIENT_ORGANIZATIONS_QUERY)
+
+
+# --- Выборка по id ---
+
+async def get_organization_by_id(org_id):
+    return await _fetchone(ORGANIZATION_BY_ID_QUERY, (org_id,))
+
+async def get_course_by_id(course_id):
+    return await _fetchone(COURSE_BY_ID_QUERY, (course_id,))
+
+async def get_current_price(course_id):
+    return await _fetchone(CURRENT_PRICE_QUERY, (course_id,))
+
+async def get_teacher_by_id(teacher_id):
+    return await _fetchone(TEACHER_BY_ID_QUERY, (teacher_id,))
+
+async def get_training_request_by_id(request_id):
+    return await _fetchone(TRAINING_REQUEST_BY_ID_QUERY, (request_id,))
+
+
+# --- Отчеты ---
+
+@report_cache.memoize('price_list', _price_list_tags)
+async def get_organization_price_list(org_id, target_date):
+    return await _fetchall(ORGANIZATION_PRICE_LIST_QUERY, (target_date, org_id))
+
+async def get_organization_price_lists(org_ids, target_dates):
+    org_ids = [int(org_id) for org_id in org_ids]
+    target_dates = [d if isinstance(d, date) else date.fromisoformat(d) for d in target_dates]
+    price_lists = {(org_id, target_date): [] for org_id in org_ids for target_date in target_dates}
+    if not price_lists:
+        return price_lists
+    for row in await _fetchall(ORGANIZATION_PRICE_LISTS_QUERY, (org_ids, target_dates)):
+        price_lists[(row[0], row[1])].append(row[2:])
+    return price_lists
+
+@report_cache.memoize('teacher_schedule', _teacher_schedule_tags)
+async def get_teacher_schedule(teacher_id, start_date, end_date):
+    return await _fetchall(TEACHER_SCHEDULE_QUERY, (teacher_id, start_date, end_date))
+
+@report_cache.memoize('teachers_schedule', _teacher_schedule_tags)
+async def get_teachers_schedule(teacher_ids, start_date, end_date):
+    return await _fetchall(TEACHERS_SCHEDULE_QUERY,
+                           ([int(teacher_id) for teacher_id in teacher_ids], start_date, end_date))
+
+@report_cache.memoize('teachers_lessons_summary', _teacher_schedule_tags)
+async def get_teachers_lessons_summary(teacher_ids, start_date, end_date):
+    rows = await _fetchall(TEACHERS_LESSONS_SUMMARY_QUERY,
+                           ([int(teacher_id) for teacher_id in teacher_ids], start_date, end_date))
+    return {row[0]: row for row in rows}
+
+@report_cache.memoize('group_filling', _group_filling_tags)
+async def get_course_group_filling(course_id, start_date, end_date):
+    rows = await _fetchall(GROUP_FILLING_QUERY.format(course_filter='c.id = %s'),
+                           (start_date, end_date, start_date, end_date, course_id))
+    return next(iter(_group_filling_by_course(rows).values()), None)
+
+async def get_courses_group_filling(start_date, end_date, course_ids=None, organization_id=None):
+    course_filter, course_param = _group_filling_filter(course_ids, organization_id)
+    rows = await _fetchall(GROUP_FILLING_QUERY.format(course_filter=course_filter),
+                           (start_date, end_date, start_date, end_date, course_param))
+    return _group_filling_by_course(rows)
+
+async def get_course_schedule(course_id, start_date, end_date):
+    return await _fetchall(COURSE_SCHEDULE_QUERY, (course_id, start_date, end_date))
+
+
+async def _count_dashboard_rows(estimate):
+    if estimate:
+        return await _fetchone(DASHBOARD_ESTIMATE_QUERY,
+                               {'threshold': settings.DASHBOARD_STATS_ESTIMATE_THRESHOLD})
+    return await _fetchone(DASHBOARD_COUNT_QUERY)
+
+async def get_dashboard_stats(estimate=None):
+    if estimate is None:
+        estimate = settings.DASHBOARD_STATS_ESTIMATE
+    async def count():
+        return _dashboard_stats(await _count_dashboard_rows(estimate))
+    return await dashboard_stats_cache.aget_or_set(('dashboard', estimate), count)
+
+
+# --- Вызов из синхронного кода ---
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='db-requests-async', daemon=True).start()
+    return _loop
+
+
+async def _gather(coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+def run(*coroutines, timeout=None):
+    """
+    Runs the coroutines concurrently on a shared background event loop and
+    returns their results in order; lets synchronous Flask views issue
+    independent queries at the same time, e.g.
+    `course, organizations = run(get_course_by_id(1), get_all_organizations())`.
+    Gives up after `timeout` seconds (by default DB_PARALLEL_TIMEOUT) and
+    cancels the coroutines.
+    """
+    if timeout is None:
+        timeout = settings.DB_PARALLEL_TIMEOUT
+    future = asyncio.run_coroutine_threadsafe(_gather(coroutines), _background_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
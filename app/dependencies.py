@@ -0,0 +1,98 @@
+from collections import namedtuple
+
+# (таблица, колонка) со ссылками на строку удаляемой таблицы
+REFERENCES = {
+    'organizations': [
+        ('courses', 'organization_id'),
+        ('teacher_organization', 'organization_id'),
+    ],
+    'courses': [
+        ('training_requests', 'course_id'),
+        ('teacher_assignments', 'course_id'),
+        ('price_documents', 'course_id'),
+        ('course_lead_teacher', 'course_id'),
+        ('course_tag_relationship', 'course_id'),
+    ],
+    'teachers': [
+        ('teacher_assignments', 'teacher_id'),
+        ('course_lead_teacher', 'lead_teacher_id'),
+        ('teacher_organization', 'teacher_id'),
+    ],
+}
+
+# Колонки, которыми удаленная/заблокированная строка описывается в отчете
+LABEL_COLUMNS = {
+    'organizations': ('code', 'name'),
+    # organization_id - для сброса прайс-листа организации удаленного курса
+    'courses': ('code', 'name', 'organization_id'),
+    'teachers': ('code', 'full_name'),
+}
+
+BatchDeleteResult = namedtuple('BatchDeleteResult', ['deleted', 'blocked', 'missing'])
+
+
+def _blocked_by(table, alias):
+    # EXISTS останавливается на первой найденной ссылке, в отличие от COUNT(*)
+    probes = ',\n                    '.join(
+        f"CASE WHEN EXISTS (SELECT 1 FROM {ref_table} r WHERE r.{ref_column} = {alias}.id) "
+        f"THEN '{ref_table}' END"
+        for ref_table, ref_column in REFERENCES[table]
+    )
+    return f"array_remove(ARRAY[\n                    {probes}\n                ], NULL)"
+
+
+def references_query(table):
+    """
+    SELECT returning (id, [referencing tables]) for every id of the %s array
+    that exists in `table`; one round-trip for any number of ids.
+    """
+    return f"""
+            SELECT ids.id, {_blocked_by(table, 'ids')} AS blocked_by
+            FROM (SELECT DISTINCT unnest(%s::int[]) AS id) ids
+            JOIN {table} t ON t.id = ids.id
+            ORDER BY ids.id;
+            """
+
+
+def delete_query(table):
+    """
+    Deletes every id of the %s array that is not referenced and returns
+    (id, label..., blocked_by, deleted) for every existing id.
+    """
+    labels = ', '.join(f'c.{column}' for column in LABEL_COLUMNS[table])
+    label_columns = ', '.join(f't.{column}' for column in LABEL_COLUMNS[table])
+    return f"""
+            WITH checked AS (
+                SELECT t.id, {label_columns}, {_blocked_by(table, 't')} AS blocked_by
+                FROM {table} t
+                WHERE t.id = ANY(%s::int[])
+            ),
+            deleted AS (
+                DELETE FROM {table} t
+                USING checked c
+                WHERE t.id = c.id AND cardinality(c.blocked_by) = 0
+                RETURNING t.id
+            )
+            SELECT c.id, {labels}, c.blocked_by, d.id IS NOT NULL AS deleted
+            FROM checked c
+            LEFT JOIN deleted d ON d.id = c.id
+            ORDER BY c.id;
+            """
+
+
+def batch_delete_result(ids, rows):
+    """
+    Splits delete_query rows into BatchDeleteResult: deleted rows
+    (id, label...), blocked {id: (row, [tables])} and missing ids.
+    """
+    deleted = []
+    blocked = {}
+    found = set()
+    for row in rows:
+        found.add(row[0])
+        if row[-1]:
+            deleted.append(tuple(row[:-2]))
+        else:
+            blocked[row[0]] = (tuple(row[:-2]), list(row[-2]))
+    missing = sorted(set(ids) - found)
+    return BatchDeleteResult(deleted, blocked, missing)
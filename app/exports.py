@@ -0,0 +1,92 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import time
+from decimal import Decimal
+
+from config import settings
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+TRAINING_REQUESTS_HEADER = ['ID', '№ заявки', 'Дата', 'Клиент', 'Курс', 'Срок', 'Студентов', 'Статус']
+PRICE_LIST_HEADER = ['Код курса', 'Название курса', 'Тип', 'Дней обучения', 'Текущая цена',
+                     'Цена с НДС', 'Документ', 'Дата документа']
+TEACHER_SCHEDULE_HEADER = ['Курс', 'Дата начала', 'Дата окончания', 'Дата занятия',
+                           'Время начала', 'Время окончания']
+TEACHERS_SCHEDULE_HEADER = ['Преподаватель'] + TEACHER_SCHEDULE_HEADER
+GROUP_FILLING_HEADER = ['№ заявки', 'Дата заявки', 'Студентов', 'Статус', 'Наполнение', 'Процент']
+
+
+def xlsx_available():
+    return xlsxwriter is not None
+
+
+def iter_csv(header, rows, chunk_rows=None):
+    """
+    Yields CSV text in chunks of `chunk_rows` rows, so only one chunk is held in memory.
+    """
+    chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM, чтобы Excel правильно открывал кириллицу
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+
+
+def iter_xlsx(header, rows, sheet_name='Export', chunk_size=64 * 1024):
+    """
+    Writes rows to a temporary workbook in xlsxwriter's constant-memory mode
+    and yields the finished file in binary chunks.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError('XLSX export requires the xlsxwriter package')
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'default_date_format': 'dd.mm.yyyy',
+            'remove_timezone': True,
+        })
+        sheet = workbook.add_worksheet(sheet_name)
+        sheet.write_row(0, 0, header)
+        for row_number, row in enumerate(rows, 1):
+            sheet.write_row(row_number, 0, [_xlsx_value(value) for value in row])
+        workbook.close()
+
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def _xlsx_value(value):
+    # xlsxwriter не умеет писать Decimal и time напрямую
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, time):
+        return value.isoformat()
+    return value
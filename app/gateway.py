@@ -0,0 +1,87 @@
+import threading
+
+from psycopg2.extras import execute_values
+
+BULK_PAGE_SIZE = 1000
+
+
+class TableGateway:
+    """
+    Builds UPDATE statements for one table. `columns` maps every updatable
+    column to its SQL type (used to cast VALUES rows in bulk updates); the
+    statement text is compiled once per combination of changed columns.
+    """
+
+    def __init__(self, table, columns, returning, key='id', key_type='integer'):
+        self.table = table
+        self.columns = dict(columns)
+        self.returning = list(returning)
+        self.key = key
+        self.key_type = key_type
+        self._update_sql = {}
+        self._bulk_sql = {}
+        self._lock = threading.Lock()
+
+    def _changed(self, values):
+        # None означает "не менять", как и в прежних update_*
+        unknown = [column for column in values if column not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown columns for {self.table}: {', '.join(unknown)}")
+        return tuple(column for column in self.columns if values.get(column) is not None)
+
+    def _compiled(self, cache, columns, build):
+        sql = cache.get(columns)
+        if sql is None:
+            with self._lock:
+                sql = cache.setdefault(columns, build(columns))
+        return sql
+
+    def _build_update(self, columns):
+        assignments = ', '.join(f'{column} = %s' for column in columns)
+        return (f"UPDATE {self.table} SET {assignments} WHERE {self.key} = %s "
+                f"RETURNING {', '.join(self.returning)};")
+
+    def _build_bulk(self, columns):
+        assignments = ', '.join(f'{column} = v.{column}' for column in columns)
+        returning = ', '.join(f't.{column}' for column in self.returning)
+        sql = (f"UPDATE {self.table} AS t SET {assignments} "
+               f"FROM (VALUES %s) AS v({self.key}, {', '.join(columns)}) "
+               f"WHERE t.{self.key} = v.{self.key} RETURNING {returning};")
+        # VALUES без приведения типов получает text, поэтому кастуем каждую колонку
+        template = '(' + ', '.join([f'%s::{self.key_type}'] + [f'%s::{self.columns[c]}' for c in columns]) + ')'
+        return sql, template
+
+    def update_sql(self, columns):
+        return self._compiled(self._update_sql, tuple(columns), self._build_update)
+
+    def update(self, cur, key_value, **values):
+        """
+        Updates the non-None `values` of one row; returns the RETURNING row,
+        or None when nothing was given or the row does not exist.
+        """
+        columns = self._changed(values)
+        if not columns:
+            return None
+        cur.execute(self.update_sql(columns), [values[column] for column in columns] + [key_value])
+        return cur.fetchone()
+
+    def bulk_update(self, cur, rows):
+        """
+        Updates many rows with one UPDATE ... FROM (VALUES ...) per combination
+        of changed columns. `rows` are dicts holding the key and the new
+        values; returns the RETURNING rows of all updated records.
+        """
+        groups = {}
+        for row in rows:
+            values = {column: value for column, value in row.items() if column != self.key}
+            columns = self._changed(values)
+            if columns:
+                groups.setdefault(columns, []).append(
+                    (row[self.key],) + tuple(values[column] for column in columns))
+
+        updated = []
+        for columns, values in groups.items():
+            sql, template = self._compiled(self._bulk_sql, columns, self._build_bulk)
+            updated.extend(execute_values(cur, sql, values, template=template,
+                                          page_size=BULK_PAGE_SIZE, fetch=True))
+        return updated
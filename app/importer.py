@@ -0,0 +1,218 @@
+import argparse
+import csv
+import io
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+import db_requests
+from db_conn import db
+
+REQUIRED_COLUMNS = ['request_number', 'client_organization', 'course_code',
+                    'required_deadline', 'total_students']
+OPTIONAL_COLUMNS = ['status', 'start_date', 'end_date']
+STATUSES = ('новая', 'подтверждена', 'отклонена', 'завершена')
+BATCH_SIZE = 1000
+
+ImportReport = namedtuple('ImportReport', ['total_rows', 'imported', 'errors', 'elapsed', 'rows_per_second'])
+
+
+def _parse_date(value):
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'invalid date {value!r}')
+
+
+def _validate_row(row):
+    values = {key: (row.get(key) or '').strip() for key in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+    missing = [key for key in REQUIRED_COLUMNS if not values[key]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    try:
+        total_students = int(values['total_students'])
+    except ValueError:
+        raise ValueError(f"invalid total_students {values['total_students']!r}") from None
+    if total_students < 1:
+        raise ValueError('total_students must be positive')
+
+    status = values['status'] or 'новая'
+    if status not in STATUSES:
+        raise ValueError(f'unknown status {status!r}')
+
+    start_date = _parse_date(values['start_date']) if values['start_date'] else None
+    end_date = _parse_date(values['end_date']) if values['end_date'] else None
+    if (start_date is None) != (end_date is None):
+        raise ValueError('start_date and end_date must be given together')
+    if start_date and end_date and start_date > end_date:
+        raise ValueError('start_date is after end_date')
+
+    return {
+        'request_number': values['request_number'],
+        'client_organization': values['client_organization'],
+        'course_code': values['course_code'],
+        'required_deadline': _parse_date(values['required_deadline']),
+        'total_students': total_students,
+        'status': status,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _resolve_ids(cur, rows):
+    # Справочники и уже занятые номера разрешаем тремя запросами на весь файл.
+    # Название клиента не уникально: при нескольких совпадениях id = None
+    cur.execute("SELECT name, id FROM client_organizations WHERE name = ANY(%s);",
+                (sorted({row['client_organization'] for row in rows}),))
+    organizations = {}
+    for name, org_id in cur.fetchall():
+        organizations[name] = None if name in organizations else org_id
+    cur.execute("SELECT code, id FROM courses WHERE code = ANY(%s);",
+                (sorted({row['course_code'] for row in rows}),))
+    courses = dict(cur.fetchall())
+    cur.execute("SELECT request_number FROM training_requests WHERE request_number = ANY(%s);",
+                ([row['request_number'] for row in rows],))
+    existing = {number for number, in cur.fetchall()}
+    return organizations, courses, existing
+
+
+def _insert_rows(cur, rows, errors, strict):
+    organizations, courses, existing = _resolve_ids(cur, rows)
+
+    valid_rows = []
+    for row in rows:
+        if row['request_number'] in existing:
+            errors.append((row['line'], f"request_number {row['request_number']!r} already exists"))
+        elif row['client_organization'] not in organizations:
+            errors.append((row['line'], f"unknown client organization {row['client_organization']!r}"))
+        elif organizations[row['client_organization']] is None:
+            errors.append((row['line'], f"ambiguous client organization {row['client_organization']!r}"))
+        elif row['course_code'] not in courses:
+            errors.append((row['line'], f"unknown course code {row['course_code']!r}"))
+        else:
+            valid_rows.append(row)
+    if not valid_rows or (strict and errors):
+        return 0, set()
+
+    # ON CONFLICT - на случай номера, занятого параллельной вставкой после проверки
+    request_ids = dict(execute_values(cur, """
+        INSERT INTO training_requests (request_number, client_organization_id, course_id,
+                                     required_deadline, total_students, status)
+        VALUES %s
+        ON CONFLICT (request_number) DO NOTHING
+        RETURNING request_number, id;
+        """,
+        [(row['request_number'], organizations[row['client_organization']],
+          courses[row['course_code']], row['required_deadline'],
+          row['total_students'], row['status']) for row in valid_rows],
+        page_size=BATCH_SIZE, fetch=True))
+    if len(request_ids) < len(valid_rows):
+        for row in valid_rows:
+            if row['request_number'] not in request_ids:
+                errors.append((row['line'], f"request_number {row['request_number']!r} already exists"))
+        if strict:
+            raise _Rollback()
+        valid_rows = [row for row in valid_rows if row['request_number'] in request_ids]
+
+    dates = [(request_ids[row['request_number']], row['start_date'], row['end_date'])
+             for row in valid_rows if row['start_date']]
+    if dates:
+        execute_values(cur, """
+            INSERT INTO course_dates (training_request_id, start_date, end_date)
+            VALUES %s;
+            """,
+            dates, page_size=BATCH_SIZE)
+    return len(valid_rows), {courses[row['course_code']] for row in valid_rows}
+
+
+def import_training_requests(fileobj, strict=False):
+    """
+    Loads training requests (and their course dates) from CSV text in one
+    transaction using batched multi-row INSERTs. Rows that fail validation are
+    reported as (line, message) and skipped, as are rows whose request_number
+    is already taken or whose client organization name is ambiguous; with
+    strict=True nothing is imported when any row is invalid.
+
+    Caches of the calling process are invalidated directly. Other processes
+    (the web workers when this runs from the command line) see the change
+    through table_versions, which the insert triggers bump.
+    """
+    started = time.perf_counter()
+    reader = csv.DictReader(fileobj)
+    header = reader.fieldnames or []
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing_columns:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing_columns)}")
+
+    errors = []
+    rows = []
+    seen_numbers = {}
+    total_rows = 0
+    for row in reader:
+        total_rows += 1
+        line = reader.line_num
+        try:
+            parsed = _validate_row(row)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        if parsed['request_number'] in seen_numbers:
+            errors.append((line, f"duplicate request_number {parsed['request_number']!r} "
+                                 f"(first on line {seen_numbers[parsed['request_number']]})"))
+            continue
+        seen_numbers[parsed['request_number']] = line
+        parsed['line'] = line
+        rows.append(parsed)
+
+    imported = 0
+    course_ids = set()
+    if rows:
+        try:
+            with db.transaction() as connection, connection.cursor() as cur:
+                imported, course_ids = _insert_rows(cur, rows, errors, strict)
+        except _Rollback:
+            imported, course_ids = 0, set()
+    if imported:
+        db_requests.invalidate_caches('training_requests', 'course_dates',
+                                      keys=[('course', course_id) for course_id in course_ids])
+
+    errors.sort()
+    elapsed = time.perf_counter() - started
+    return ImportReport(
+        total_rows=total_rows,
+        imported=imported,
+        errors=errors,
+        elapsed=elapsed,
+        rows_per_second=imported / elapsed if elapsed > 0 else 0.0,
+    )
+
+
+def import_training_requests_file(path, strict=False):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return import_training_requests(f, strict=strict)
+
+
+def open_upload(stream):
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import of training requests from CSV.')
+    parser.add_argument('path', help='CSV file with columns: ' + ', '.join(REQUIRED_COLUMNS + OPTIONAL_COLUMNS))
+    parser.add_argument('--strict', action='store_true', help='import nothing if any row is invalid')
+    args = parser.parse_args()
+
+    report = import_training_requests_file(args.path, strict=args.strict)
+    for line, message in report.errors:
+        print(f'line {line}: {message}')
+    print(f'{report.imported}/{report.total_rows} rows imported in {report.elapsed:.2f}s '
+          f'({report.rows_per_second:.0f} rows/s)')
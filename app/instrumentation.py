@@ -0,0 +1,217 @@
+import logging
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from config import settings
+from rows import RecordCursor
+
+logger = logging.getLogger('slow_queries')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Модули, которые пропускаем при поиске вызывающей функции
+_SKIP_MODULES = {__name__, 'psycopg2.extras', 'psycopg2.extensions', 'contextlib', 'db_conn', 'prepared',
+                 'gateway', 'dependencies'}
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; `counts[i]` holds observations that fall into
+    bucket i only, cumulative counts are produced when rendering.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class FunctionStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.rows = 0
+        self.errors = 0
+
+
+class Metrics:
+    def __init__(self, slow_query_threshold=0.5):
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_queries = 0
+        self._functions = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record_query(self, function, duration, rows, failed, query):
+        with self._lock:
+            stats = self._functions.get(function)
+            if stats is None:
+                stats = self._functions[function] = FunctionStats()
+            stats.latency.observe(duration)
+            if rows > 0:
+                stats.rows += rows
+            if failed:
+                stats.errors += 1
+            if duration >= self.slow_query_threshold:
+                self.slow_queries += 1
+
+        context = getattr(self._local, 'request', None)
+        if context is not None:
+            # один контекст могут пополнять потоки parallel.run
+            with self._lock:
+                context[0] += 1
+                context[1] += duration
+
+        if duration >= self.slow_query_threshold:
+            logger.warning('slow query %.1f ms in %s: %s', duration * 1000, function,
+                           _WHITESPACE.sub(' ', _query_text(query)).strip()[:1000])
+
+    def begin_request(self):
+        self._local.request = [0, 0.0]
+
+    def request_context(self):
+        return getattr(self._local, 'request', None)
+
+    def join_request(self, context):
+        """
+        Counts this thread's queries into another thread's request context
+        (from request_context()); None detaches it.
+        """
+        self._local.request = context
+
+    def end_request(self, endpoint):
+        """
+        Closes the per-request context and returns (round_trips, db_seconds).
+        """
+        context = getattr(self._local, 'request', None)
+        if context is None:
+            return 0, 0.0
+        self._local.request = None
+        queries, db_time = context
+        with self._lock:
+            histograms = self._requests.get(endpoint)
+            if histograms is None:
+                histograms = self._requests[endpoint] = (Histogram(QUERIES_PER_REQUEST_BUCKETS),
+                                                         Histogram(LATENCY_BUCKETS))
+            histograms[0].observe(queries)
+            histograms[1].observe(db_time)
+        return queries, db_time
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'calls': stats.latency.count,
+                    'errors': stats.errors,
+                    'rows': stats.rows,
+                    'total_seconds': round(stats.latency.sum, 6),
+                }
+                for name, stats in self._functions.items()
+            }
+
+    def render_prometheus(self, gauges=None):
+        """
+        Renders all metrics in the Prometheus text exposition format; `gauges`
+        maps extra metric names to plain values (pool state etc).
+        """
+        lines = []
+        with self._lock:
+            lines += _histogram_family('db_query_duration_seconds',
+                                       'Database round-trip time by db_requests function.',
+                                       'function', {name: s.latency for name, s in self._functions.items()})
+            lines += ['# HELP db_query_rows_total Rows returned or affected by db_requests function.',
+                      '# TYPE db_query_rows_total counter']
+            lines += [f'db_query_rows_total{{function="{_label(name)}"}} {s.rows}'
+                      for name, s in sorted(self._functions.items())]
+            lines += ['# HELP db_query_errors_total Failed queries by db_requests function.',
+                      '# TYPE db_query_errors_total counter']
+            lines += [f'db_query_errors_total{{function="{_label(name)}"}} {s.errors}'
+                      for name, s in sorted(self._functions.items())]
+            lines += ['# HELP db_slow_queries_total Queries slower than the slow-query threshold.',
+                      '# TYPE db_slow_queries_total counter',
+                      f'db_slow_queries_total {self.slow_queries}']
+            lines += _histogram_family('http_request_db_queries',
+                                       'Database round-trips per HTTP request.',
+                                       'endpoint', {name: h[0] for name, h in self._requests.items()})
+            lines += _histogram_family('http_request_db_duration_seconds',
+                                       'Time spent in the database per HTTP request.',
+                                       'endpoint', {name: h[1] for name, h in self._requests.items()})
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_family(name, help_text, label, histograms):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items()):
+        key = _label(key)
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+    return lines
+
+
+def _query_text(query):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    return str(query)
+
+
+def _caller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__')
+        if module not in _SKIP_MODULES:
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+metrics = Metrics(slow_query_threshold=settings.SLOW_QUERY_THRESHOLD)
+
+
+class InstrumentedCursor(RecordCursor):
+    """
+    Cursor that times every execute and attributes it to the calling function.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            metrics.record_query(_caller(), time.perf_counter() - started,
+                                 self.rowcount, failed, query)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            metrics.record_query(_caller(), time.perf_counter() - started,
+                                 self.rowcount, failed, query)
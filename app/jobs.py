@@ -0,0 +1,183 @@
+import logging
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import psycopg2
+
+from config import settings
+from db_conn import db, instance_name
+from instrumentation import metrics
+
+logger = logging.getLogger('jobs')
+
+# Ключ advisory-блокировки очереди фоновых задач
+JOBS_LOCK_KEY = 7401207
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    Snapshot of one background job as stored in report_jobs. `done`/`total`
+    are the progress reported by the job function; `result` is its return
+    value once status is 'done' (loaded only when asked for, see JobRunner.get).
+    """
+
+    def __init__(self, id, kind, status, done, total, error, created_at, started_at, finished_at,
+                 result=None):
+        self.id = id
+        self.kind = kind
+        self.status = status
+        self.done = done
+        self.total = total
+        self.error = error
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.result = result
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'percent': round(100 * self.done / self.total) if self.total else None,
+            'error': self.error,
+            'elapsed': round((self.finished_at or time.time()) - (self.started_at or self.created_at), 3),
+        }
+
+
+JOB_COLUMNS = """
+            id, kind, status, done, total, error,
+            extract(epoch FROM created_at)::float8,
+            extract(epoch FROM started_at)::float8,
+            extract(epoch FROM finished_at)::float8"""
+
+
+class JobRunner:
+    """
+    Runs jobs on a bounded thread pool so long reports do not hold a web
+    worker. A job runs in the process that accepted it, but its state and
+    result live in the report_jobs table (migration 6), so any worker can
+    show them. At most `queue_limit` jobs may be queued or running across
+    all workers; jobs are kept for `result_ttl` seconds after they finish,
+    or after they were queued if the process running them died.
+    """
+
+    def __init__(self, workers=2, queue_limit=10, result_ttl=3600.0):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _purge(self, cur):
+        cur.execute("""
+            DELETE FROM report_jobs
+            WHERE COALESCE(finished_at, created_at) < now() - make_interval(secs => %s);
+            """,
+            (self.result_ttl,))
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Queues func(*args, progress=..., **kwargs) and returns the job id;
+        raises QueueFull when queue_limit jobs are already pending.
+        """
+        job_id = uuid.uuid4().hex
+        with db.transaction() as connection, connection.cursor() as cur:
+            # очередь общая у всех воркеров - подсчет и вставка под одной блокировкой
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (JOBS_LOCK_KEY,))
+            self._purge(cur)
+            cur.execute("SELECT COUNT(*) FROM report_jobs WHERE status IN ('queued', 'running');")
+            if cur.fetchone()[0] >= self.queue_limit:
+                raise QueueFull(f'{self.queue_limit} jobs are already queued or running')
+            cur.execute("""
+                INSERT INTO report_jobs (id, kind, status, owner)
+                VALUES (%s, %s, 'queued', %s);
+                """,
+                (job_id, kind, instance_name()))
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._executor.submit(self._run, job_id, kind, func, args, kwargs)
+        return job_id
+
+    def _update(self, job_id, assignments, params=()):
+        with db.get_connection() as connection, connection.cursor() as cur:
+            cur.execute(f"UPDATE report_jobs SET {assignments} WHERE id = %s;", (*params, job_id))
+
+    def _progress(self, job_id):
+        def progress(done, total=None):
+            self._update(job_id, 'done = %s, total = COALESCE(%s, total)', (done, total))
+        return progress
+
+    def _run(self, job_id, kind, func, args, kwargs):
+        metrics.begin_request()
+        try:
+            self._update(job_id, "status = 'running', started_at = now()")
+            result = func(*args, progress=self._progress(job_id), **kwargs)
+            self._update(job_id, "status = 'done', finished_at = now(), result = %s",
+                         (psycopg2.Binary(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)),))
+        except Exception as e:
+            logger.exception('job %s (%s) failed', job_id, kind)
+            try:
+                self._update(job_id, "status = 'failed', finished_at = now(), error = %s", (str(e),))
+            except Exception:
+                logger.exception('job %s (%s): failed to record the failure', job_id, kind)
+        finally:
+            metrics.end_request(f'job:{kind}')
+
+    def get(self, job_id, result=False):
+        """
+        The job with `job_id`, or None; with `result` a finished job's result is loaded too.
+        """
+        with db.get_connection() as connection, connection.cursor() as cur:
+            cur.execute(f"""
+                SELECT {JOB_COLUMNS}, {'result' if result else 'NULL'}
+                FROM report_jobs
+                WHERE id = %s;
+                """,
+                (job_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        job = Job(*row[:-1])
+        if row[-1] is not None:
+            job.result = pickle.loads(row[-1])
+        return job
+
+    def stats(self):
+        with db.get_connection() as connection, connection.cursor() as cur:
+            cur.execute("SELECT status, COUNT(*) FROM report_jobs GROUP BY status;")
+            counts = dict({'queued': 0, 'running': 0, 'done': 0, 'failed': 0}, **dict(cur.fetchall()))
+        return dict(counts, workers=self.workers, queue_limit=self.queue_limit)
+
+
+def split_period(start_date, end_date, days):
+    """
+    Splits [start_date, end_date] into consecutive periods of at most `days` days.
+    """
+    start = start_date if isinstance(start_date, date) else date.fromisoformat(start_date)
+    end = end_date if isinstance(end_date, date) else date.fromisoformat(end_date)
+    periods = []
+    while start <= end:
+        period_end = min(start + timedelta(days=days - 1), end)
+        periods.append((start, period_end))
+        start = period_end + timedelta(days=1)
+    return periods
+
+
+runner = JobRunner(workers=settings.JOB_WORKERS, queue_limit=settings.JOB_QUEUE_LIMIT,
+                   result_ttl=settings.JOB_RESULT_TTL)
@@ -0,0 +1,670 @@
+import argparse
+import re
+from collections import namedtuple
+
+import rollups
+from db_conn import db
+
+Migration = namedtuple('Migration', ['version', 'name', 'statements', 'transactional'])
+
+# Ключ advisory-блокировки, чтобы две миграции не выполнялись одновременно
+MIGRATION_LOCK_KEY = 7401206
+
+# Таблицы, изменения которых отслеживает table_versions
+VERSIONED_TABLES = [
+    'organizations', 'course_types', 'courses', 'client_organizations', 'training_requests',
+    'course_dates', 'price_documents', 'teachers', 'teacher_assignments', 'schedule',
+    'course_lead_teacher', 'course_tags', 'course_tag_relationship', 'teacher_organization',
+]
+
+MIGRATIONS = [
+    Migration(1, 'base schema', [
+        """
+        CREATE TABLE IF NOT EXISTS organizations (
+            id SERIAL PRIMARY KEY,
+            code VARCHAR(20) NOT NULL UNIQUE,
+            name VARCHAR(255) NOT NULL,
+            address TEXT NOT NULL,
+            phone VARCHAR(50),
+            email VARCHAR(255)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS course_types (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE
+        );
+        """,
+        """
+        INSERT INTO course_types (name)
+        VALUES ('Профессиональная переподготовка'), ('Повышение квалификации')
+        ON CONFLICT (name) DO NOTHING;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS courses (
+            id SERIAL PRIMARY KEY,
+            code VARCHAR(20) NOT NULL UNIQUE,
+            name VARCHAR(255) NOT NULL,
+            type_id INTEGER NOT NULL REFERENCES course_types (id),
+            training_days INTEGER NOT NULL CHECK (training_days > 0),
+            max_students INTEGER NOT NULL CHECK (max_students > 0),
+            base_price NUMERIC(12, 2) NOT NULL CHECK (base_price >= 0),
+            vat_price NUMERIC(12, 2) GENERATED ALWAYS AS (base_price * 1.2) STORED,
+            organization_id INTEGER NOT NULL REFERENCES organizations (id),
+            is_active BOOLEAN NOT NULL DEFAULT true
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS client_organizations (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            address TEXT NOT NULL,
+            phone VARCHAR(50),
+            email VARCHAR(255)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS training_requests (
+            id SERIAL PRIMARY KEY,
+            request_number VARCHAR(50) NOT NULL UNIQUE,
+            request_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            client_organization_id INTEGER NOT NULL REFERENCES client_organizations (id),
+            course_id INTEGER NOT NULL REFERENCES courses (id),
+            required_deadline DATE NOT NULL,
+            total_students INTEGER NOT NULL CHECK (total_students > 0),
+            status VARCHAR(20) NOT NULL DEFAULT 'новая'
+                CHECK (status IN ('новая', 'подтверждена', 'отклонена', 'завершена'))
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS course_dates (
+            id SERIAL PRIMARY KEY,
+            training_request_id INTEGER NOT NULL REFERENCES training_requests (id) ON DELETE CASCADE,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            CHECK (end_date >= start_date)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS price_documents (
+            id SERIAL PRIMARY KEY,
+            document_number VARCHAR(50) NOT NULL,
+            document_date DATE NOT NULL,
+            price NUMERIC(12, 2) NOT NULL CHECK (price >= 0),
+            course_id INTEGER NOT NULL REFERENCES courses (id),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS teachers (
+            id SERIAL PRIMARY KEY,
+            code VARCHAR(20) NOT NULL UNIQUE,
+            full_name VARCHAR(255) NOT NULL,
+            birth_date DATE NOT NULL,
+            gender CHAR(1) CHECK (gender IN ('M', 'F')),
+            education VARCHAR(255),
+            category VARCHAR(100)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS teacher_assignments (
+            id SERIAL PRIMARY KEY,
+            document_number VARCHAR(50) NOT NULL,
+            document_date DATE NOT NULL,
+            teacher_id INTEGER NOT NULL REFERENCES teachers (id),
+            course_id INTEGER NOT NULL REFERENCES courses (id),
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            CHECK (end_date >= start_date)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS schedule (
+            id SERIAL PRIMARY KEY,
+            teacher_assignment_id INTEGER NOT NULL REFERENCES teacher_assignments (id),
+            lesson_date DATE NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            CHECK (end_time > start_time)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS course_lead_teacher (
+            id SERIAL PRIMARY KEY,
+            course_id INTEGER NOT NULL UNIQUE REFERENCES courses (id),
+            lead_teacher_id INTEGER NOT NULL REFERENCES teachers (id),
+            assigned_date DATE NOT NULL DEFAULT CURRENT_DATE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS course_tags (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS course_tag_relationship (
+            id SERIAL PRIMARY KEY,
+            course_id INTEGER NOT NULL REFERENCES courses (id),
+            tag_id INTEGER NOT NULL REFERENCES course_tags (id),
+            UNIQUE (course_id, tag_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS teacher_organization (
+            id SERIAL PRIMARY KEY,
+            teacher_id INTEGER NOT NULL REFERENCES teachers (id),
+            organization_id INTEGER NOT NULL REFERENCES organizations (id),
+            UNIQUE (teacher_id, organization_id)
+        );
+        """,
+    ], True),
+
+    # Индексы под запросы db_requests; CONCURRENTLY нельзя выполнять в транзакции
+    Migration(2, 'query pattern indexes', [
+        # отчет о наполнении групп: course_id + диапазон request_date + status
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_requests_course_date
+        ON training_requests (course_id, request_date)
+        INCLUDE (status, total_students, request_number);
+        """,
+        # постраничный список заявок (request_date DESC, id DESC)
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_requests_date_id
+        ON training_requests (request_date DESC, id DESC);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_requests_status_date
+        ON training_requests (status, request_date);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_requests_client_organization
+        ON training_requests (client_organization_id);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_dates_training_request
+        ON course_dates (training_request_id, start_date);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_schedule_assignment_date
+        ON schedule (teacher_assignment_id, lesson_date)
+        INCLUDE (start_time, end_time);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_price_documents_course_date
+        ON price_documents (course_id, document_date DESC, id DESC)
+        INCLUDE (price, document_number);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teacher_assignments_teacher
+        ON teacher_assignments (teacher_id)
+        INCLUDE (course_id, start_date, end_date);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teacher_assignments_course
+        ON teacher_assignments (course_id);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_organization
+        ON courses (organization_id, name);
+        """,
+        # постраничный список преподавателей (full_name, id)
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teachers_full_name_id
+        ON teachers (full_name, id);
+        """,
+        # проверки зависимостей перед удалением
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_lead_teacher_teacher
+        ON course_lead_teacher (lead_teacher_id);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teacher_organization_organization
+        ON teacher_organization (organization_id);
+        """,
+    ], False),
+
+    # Поиск: ILIKE '%...%' и similarity() по триграммам
+    Migration(3, 'trigram search indexes', [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm;',
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_organizations_name_trgm
+        ON organizations USING gin (name gin_trgm_ops);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_organizations_code_trgm
+        ON organizations USING gin (code gin_trgm_ops);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_name_trgm
+        ON courses USING gin (name gin_trgm_ops);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_code_trgm
+        ON courses USING gin (code gin_trgm_ops);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teachers_full_name_trgm
+        ON teachers USING gin (full_name gin_trgm_ops);
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_teachers_code_trgm
+        ON teachers USING gin (code gin_trgm_ops);
+        """,
+    ], False),
+
+    # Сводки для отчетов, которые поддерживаются триггерами уровня оператора:
+    # старые версии строк (old_rows) вычитаются, новые (new_rows) прибавляются
+    Migration(4, 'report rollups', [
+        """
+        CREATE TABLE IF NOT EXISTS course_filling_daily (
+            course_id INTEGER NOT NULL REFERENCES courses (id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            groups INTEGER NOT NULL,
+            students INTEGER NOT NULL,
+            full_groups INTEGER NOT NULL,
+            PRIMARY KEY (course_id, day)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS teacher_lessons_daily (
+            teacher_id INTEGER NOT NULL REFERENCES teachers (id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            lessons INTEGER NOT NULL,
+            minutes INTEGER NOT NULL,
+            PRIMARY KEY (teacher_id, day)
+        );
+        """,
+        """
+        CREATE OR REPLACE FUNCTION course_filling_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO course_filling_daily AS f (course_id, day, groups, students, full_groups)
+                SELECT o.course_id, o.request_date, -COUNT(*), -SUM(o.total_students),
+                       -COUNT(*) FILTER (WHERE o.total_students >= c.max_students)
+                FROM old_rows o
+                JOIN courses c ON c.id = o.course_id
+                WHERE o.status IN ('подтверждена', 'завершена')
+                GROUP BY o.course_id, o.request_date
+                ON CONFLICT (course_id, day) DO UPDATE
+                SET groups = f.groups + EXCLUDED.groups,
+                    students = f.students + EXCLUDED.students,
+                    full_groups = f.full_groups + EXCLUDED.full_groups;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO course_filling_daily AS f (course_id, day, groups, students, full_groups)
+                SELECT n.course_id, n.request_date, COUNT(*), SUM(n.total_students),
+                       COUNT(*) FILTER (WHERE n.total_students >= c.max_students)
+                FROM new_rows n
+                JOIN courses c ON c.id = n.course_id
+                WHERE n.status IN ('подтверждена', 'завершена')
+                GROUP BY n.course_id, n.request_date
+                ON CONFLICT (course_id, day) DO UPDATE
+                SET groups = f.groups + EXCLUDED.groups,
+                    students = f.students + EXCLUDED.students,
+                    full_groups = f.full_groups + EXCLUDED.full_groups;
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        # таблицы переходов нельзя объявить у триггера на несколько событий
+        """
+        CREATE TRIGGER training_requests_filling_insert
+        AFTER INSERT ON training_requests
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_filling_apply();
+        """,
+        """
+        CREATE TRIGGER training_requests_filling_update
+        AFTER UPDATE ON training_requests
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_filling_apply();
+        """,
+        """
+        CREATE TRIGGER training_requests_filling_delete
+        AFTER DELETE ON training_requests
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_filling_apply();
+        """,
+        # full_groups зависит от max_students - пересчитываем только его
+        """
+        CREATE OR REPLACE FUNCTION course_filling_max_students() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE course_filling_daily f
+            SET full_groups = (
+                SELECT COUNT(*)
+                FROM training_requests tr
+                WHERE tr.course_id = f.course_id
+                    AND tr.request_date = f.day
+                    AND tr.status IN ('подтверждена', 'завершена')
+                    AND tr.total_students >= n.max_students
+            )
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            WHERE f.course_id = n.id AND n.max_students <> o.max_students;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        """
+        CREATE TRIGGER courses_filling_max_students
+        AFTER UPDATE ON courses
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION course_filling_max_students();
+        """,
+        """
+        CREATE OR REPLACE FUNCTION teacher_lessons_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO teacher_lessons_daily AS l (teacher_id, day, lessons, minutes)
+                SELECT ta.teacher_id, o.lesson_date, -COUNT(*),
+                       -SUM((EXTRACT(EPOCH FROM o.end_time - o.start_time) / 60)::integer)
+                FROM old_rows o
+                JOIN teacher_assignments ta ON ta.id = o.teacher_assignment_id
+                GROUP BY ta.teacher_id, o.lesson_date
+                ON CONFLICT (teacher_id, day) DO UPDATE
+                SET lessons = l.lessons + EXCLUDED.lessons,
+                    minutes = l.minutes + EXCLUDED.minutes;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO teacher_lessons_daily AS l (teacher_id, day, lessons, minutes)
+                SELECT ta.teacher_id, n.lesson_date, COUNT(*),
+                       SUM((EXTRACT(EPOCH FROM n.end_time - n.start_time) / 60)::integer)
+                FROM new_rows n
+                JOIN teacher_assignments ta ON ta.id = n.teacher_assignment_id
+                GROUP BY ta.teacher_id, n.lesson_date
+                ON CONFLICT (teacher_id, day) DO UPDATE
+                SET lessons = l.lessons + EXCLUDED.lessons,
+                    minutes = l.minutes + EXCLUDED.minutes;
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        """
+        CREATE TRIGGER schedule_lessons_insert
+        AFTER INSERT ON schedule
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION teacher_lessons_apply();
+        """,
+        """
+        CREATE TRIGGER schedule_lessons_update
+        AFTER UPDATE ON schedule
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION teacher_lessons_apply();
+        """,
+        """
+        CREATE TRIGGER schedule_lessons_delete
+        AFTER DELETE ON schedule
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION teacher_lessons_apply();
+        """,
+        # смена преподавателя в назначении переносит его занятия
+        """
+        CREATE OR REPLACE FUNCTION teacher_lessons_reassign() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO teacher_lessons_daily AS l (teacher_id, day, lessons, minutes)
+            SELECT moved.teacher_id, s.lesson_date, SUM(moved.sign),
+                   SUM(moved.sign * (EXTRACT(EPOCH FROM s.end_time - s.start_time) / 60)::integer)
+            FROM (
+                SELECT o.id, o.teacher_id, -1 AS sign
+                FROM old_rows o JOIN new_rows n ON n.id = o.id
+                WHERE n.teacher_id <> o.teacher_id
+                UNION ALL
+                SELECT n.id, n.teacher_id, 1
+                FROM old_rows o JOIN new_rows n ON n.id = o.id
+                WHERE n.teacher_id <> o.teacher_id
+            ) moved
+            JOIN schedule s ON s.teacher_assignment_id = moved.id
+            GROUP BY moved.teacher_id, s.lesson_date
+            ON CONFLICT (teacher_id, day) DO UPDATE
+            SET lessons = l.lessons + EXCLUDED.lessons,
+                minutes = l.minutes + EXCLUDED.minutes;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        """
+        CREATE TRIGGER teacher_assignments_lessons_reassign
+        AFTER UPDATE ON teacher_assignments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION teacher_lessons_reassign();
+        """,
+        *rollups.rebuild_statements('course_filling_daily'),
+        *rollups.rebuild_statements('teacher_lessons_daily'),
+    ], True),
+    Migration(5, 'table versions', [
+        # версии таблиц для ETag и сброса кэшей в других процессах;
+        # writer_since - версия, с которой подряд пишет процесс writer
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL,
+            writer TEXT NOT NULL,
+            writer_since BIGINT NOT NULL,
+            modified_at TIMESTAMPTZ NOT NULL
+        );
+        """,
+        # таблицы, измененные незавершенной транзакцией: своя строка у каждой
+        # транзакции, поэтому писатели здесь друг друга не ждут
+        """
+        CREATE TABLE IF NOT EXISTS table_versions_pending (
+            txid BIGINT NOT NULL,
+            table_name TEXT NOT NULL,
+            PRIMARY KEY (txid, table_name)
+        );
+        """,
+        """
+        CREATE OR REPLACE FUNCTION table_versions_mark() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO table_versions_pending (txid, table_name)
+            VALUES (txid_current(), TG_TABLE_NAME)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        # версия сдвигается один раз за транзакцию, при COMMIT: блокировка строки
+        # table_versions держится только до конца фиксации, а не всю транзакцию
+        """
+        CREATE OR REPLACE FUNCTION table_versions_bump() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO table_versions AS v (table_name, version, writer, writer_since, modified_at)
+            VALUES (NEW.table_name, 1, current_setting('application_name'), 1, clock_timestamp())
+            ON CONFLICT (table_name) DO UPDATE
+            SET version = v.version + 1,
+                writer = EXCLUDED.writer,
+                writer_since = CASE WHEN v.writer = EXCLUDED.writer THEN v.writer_since ELSE v.version + 1 END,
+                modified_at = EXCLUDED.modified_at;
+            DELETE FROM table_versions_pending WHERE txid = NEW.txid AND table_name = NEW.table_name;
+            RETURN NULL;
+        END;
+        $$;
+        """,
+        """
+        CREATE CONSTRAINT TRIGGER table_versions_pending_bump
+        AFTER INSERT ON table_versions_pending
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION table_versions_bump();
+        """,
+        *[f"""
+        CREATE TRIGGER {table}_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION table_versions_mark();
+        """ for table in VERSIONED_TABLES],
+    ], True),
+    Migration(6, 'report jobs', [
+        # фоновые отчеты: состояние и результат видны всем воркерам, а не только
+        # тому, который выполняет задачу; result - pickle результата
+        """
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result BYTEA,
+            error TEXT,
+            owner TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        );
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_created
+        ON report_jobs (created_at);
+        """,
+    ], True),
+]
+
+_INDEX_RE = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)',
+                       re.IGNORECASE)
+
+
+def expected_indexes():
+    """
+    Returns {index_name: table} for every index created by MIGRATIONS.
+    """
+    indexes = {}
+    for migration in MIGRATIONS:
+        for statement in migration.statements:
+            for name, table in _INDEX_RE.findall(statement):
+                indexes[name] = table
+    return indexes
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+
+
+def applied_versions():
+    with db.get_connection() as connection, connection.cursor() as cur:
+        _ensure_migrations_table(cur)
+        cur.execute("SELECT version FROM schema_migrations ORDER BY version;")
+        return [row[0] for row in cur.fetchall()]
+
+
+def upgrade(target=None):
+    """
+    Applies pending migrations up to `target` (all by default); returns the
+    versions that were applied.
+    """
+    applied = []
+    with db.get_connection() as connection, connection.cursor() as cur:
+        _ensure_migrations_table(cur)
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+        try:
+            cur.execute("SELECT version FROM schema_migrations;")
+            done = {row[0] for row in cur.fetchall()}
+            for migration in MIGRATIONS:
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+
+                if migration.transactional:
+                    connection.autocommit = False
+                    try:
+                        for statement in migration.statements:
+                            cur.execute(statement)
+                        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                                    (migration.version, migration.name))
+                        connection.commit()
+                    except Exception:
+                        connection.rollback()
+                        raise
+                    finally:
+                        connection.autocommit = True
+                else:
+                    # Все операторы идемпотентны (IF NOT EXISTS), поэтому после сбоя
+                    # миграцию можно просто запустить повторно
+                    for statement in migration.statements:
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                                (migration.version, migration.name))
+                applied.append(migration.version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+    return applied
+
+
+def check_indexes():
+    """
+    Compares the database with expected_indexes(). Reports indexes that are
+    missing or left invalid by a failed CONCURRENTLY build, and non-unique
+    indexes that have never been scanned since statistics were last reset.
+    """
+    expected = expected_indexes()
+    with db.get_connection() as connection, connection.cursor() as cur:
+        cur.execute("""
+            SELECT i.relname, ix.indisvalid
+            FROM pg_index ix
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_namespace n ON n.oid = i.relnamespace
+            WHERE n.nspname = current_schema();
+            """)
+        existing = dict(cur.fetchall())
+
+        cur.execute("""
+            SELECT s.relname, s.indexrelname, s.idx_scan,
+                   pg_size_pretty(pg_relation_size(s.indexrelid))
+            FROM pg_stat_user_indexes s
+            JOIN pg_index ix ON ix.indexrelid = s.indexrelid
+            WHERE s.schemaname = current_schema()
+                AND s.idx_scan = 0
+                AND NOT ix.indisunique
+                AND NOT ix.indisprimary
+            ORDER BY pg_relation_size(s.indexrelid) DESC;
+            """)
+        unused = cur.fetchall()
+
+    return {
+        'missing': sorted((table, name) for name, table in expected.items() if name not in existing),
+        'invalid': sorted(name for name, valid in existing.items() if not valid),
+        'unused': unused,
+    }
+
+
+def status():
+    done = set(applied_versions())
+    return [(migration.version, migration.name, migration.version in done) for migration in MIGRATIONS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Database schema migrations.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    upgrade_parser = subparsers.add_parser('upgrade', help='apply pending migrations')
+    upgrade_parser.add_argument('--target', type=int, help='stop after this version')
+    subparsers.add_parser('status', help='list migrations and whether they are applied')
+    subparsers.add_parser('check', help='report missing, invalid and unused indexes')
+    args = parser.parse_args()
+
+    if args.command == 'upgrade':
+        versions = upgrade(args.target)
+        print(f"applied: {', '.join(map(str, versions))}" if versions else 'up to date')
+    elif args.command == 'status':
+        for version, name, is_applied in status():
+            print(f"{version:>4}  {'applied' if is_applied else 'pending':<8} {name}")
+    elif args.command == 'check':
+        report = check_indexes()
+        for table, name in report['missing']:
+            print(f'missing: {table}.{name}')
+        for name in report['invalid']:
+            print(f'invalid: {name} (drop and run upgrade again)')
+        for table, name, scans, size in report['unused']:
+            print(f'unused:  {table}.{name} ({size}, {scans} scans)')
+        if not any(report.values()):
+            print('ok')
@@ -0,0 +1,109 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import date, datetime, time
+
+from config import settings
+
+Page = namedtuple('Page', ['rows', 'next_cursor', 'prev_cursor', 'limit'])
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _check_value(value, key_type):
+    # курсор приходит от клиента: значения неверного типа не должны доходить до Postgres
+    if key_type is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif key_type is str:
+        if isinstance(value, str):
+            return value
+    elif key_type in (date, datetime, time):
+        if isinstance(value, str):
+            return key_type.fromisoformat(value)
+    else:
+        raise TypeError(f'Unsupported cursor key type: {key_type!r}')
+    raise ValueError(f'Invalid page cursor value: {value!r}')
+
+
+def decode_cursor(token, key_types=None):
+    """
+    Decodes a cursor produced by encode_cursor; raises ValueError if it is malformed
+    or, when `key_types` is given, if its values do not match those types.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError(f'Invalid page cursor: {token!r}') from e
+    if not isinstance(values, list):
+        raise ValueError(f'Invalid page cursor: {token!r}')
+    if key_types is not None:
+        if len(values) != len(key_types):
+            raise ValueError(f'Invalid page cursor: {token!r}')
+        values = [_check_value(value, key_type) for value, key_type in zip(values, key_types)]
+    return values
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return settings.PAGE_SIZE
+    limit = int(limit)
+    if limit < 1:
+        return settings.PAGE_SIZE
+    return min(limit, settings.MAX_PAGE_SIZE)
+
+
+def keyset_query(query, key_columns, key_types, descending=False, after=None, before=None, limit=None):
+    """
+    Completes `query` (which must contain a `{where}` placeholder) with a keyset
+    condition, ORDER BY on `key_columns` and LIMIT. `key_types` gives the Python
+    type of each key column (int, str, date, ...) to validate cursors. Returns
+    (sql, params, limit, backward); one extra row is requested to detect whether
+    another page exists.
+    """
+    limit = clamp_limit(limit)
+    # пустой ?before= означает отсутствие курсора, а не страницу назад
+    before = before or None
+    backward = before is not None
+    token = before if backward else after
+
+    where = ''
+    params = []
+    if token:
+        values = decode_cursor(token, key_types)
+        op = '<' if descending != backward else '>'
+        placeholders = ', '.join(['%s'] * len(key_columns))
+        where = f"WHERE ({', '.join(key_columns)}) {op} ({placeholders})"
+        params.extend(values)
+
+    direction = 'DESC' if descending != backward else 'ASC'
+    order_by = ', '.join(f'{column} {direction}' for column in key_columns)
+    sql = query.format(where=where) + f'\nORDER BY {order_by}\nLIMIT %s;'
+    params.append(limit + 1)
+    return sql, params, limit, backward
+
+
+def build_page(rows, key_of, limit, backward, has_cursor):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backward:
+            next_cursor = encode_cursor(key_of(rows[-1]))
+        if (has_more and backward) or (has_cursor and not backward):
+            prev_cursor = encode_cursor(key_of(rows[0]))
+    return Page(rows, next_cursor, prev_cursor, limit)
@@ -0,0 +1,99 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+from db_conn import db
+from instrumentation import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+# Свободные потоки-помощники: задачу отдают только в свободный, в очередь - никогда
+_slots = threading.BoundedSemaphore(max(settings.DB_PARALLEL_WORKERS, 1))
+# Сколько помощников сейчас занято запросом этого потока
+_local = threading.local()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.DB_PARALLEL_WORKERS,
+                                           thread_name_prefix='query')
+        return _executor
+
+
+def _call(func, context):
+    # запросы потока-помощника считаются в метриках запроса, который их запустил
+    metrics.join_request(context)
+    try:
+        return func()
+    finally:
+        metrics.join_request(None)
+
+
+def _is_cached(call):
+    func, args, kwargs = call, (), {}
+    if isinstance(call, functools.partial):
+        func, args, kwargs = call.func, call.args, call.keywords
+    is_cached = getattr(func, 'is_cached', None)
+    return is_cached is not None and is_cached(*args, **kwargs)
+
+
+def _spare_connections():
+    # одно свободное соединение оставляем другим запросам
+    stats = db.pool_stats()
+    return stats['idle'] + stats['max_size'] - stats['size'] - stats['waiting'] - 1
+
+
+def _release(future):
+    _slots.release()
+
+
+def run(*calls, timeout=None):
+    """
+    Runs independent db_requests calls (functions without arguments, e.g.
+    functools.partial objects) at the same time and returns their results in
+    order, e.g. `course, organizations = run(partial(get_course_by_id, 1),
+    get_all_organizations)`. The calls go through the usual caches and take
+    connections from the same pool.
+
+    Calls answered from a cache, and everything inside db.transaction(), run
+    in the calling thread. Of the rest, at most DB_PARALLEL_PER_REQUEST per
+    request go to helper threads, and only while a helper and a spare pool
+    connection are free; the others run in the calling thread as well.
+    A helper that has not finished within `timeout` seconds (by default
+    DB_PARALLEL_TIMEOUT) raises concurrent.futures.TimeoutError.
+    """
+    if timeout is None:
+        timeout = settings.DB_PARALLEL_TIMEOUT
+    if len(calls) < 2 or settings.DB_PARALLEL_WORKERS < 1 or db.in_transaction():
+        return [call() for call in calls]
+
+    pending = [i for i, call in enumerate(calls) if not _is_cached(call)]
+    helpers = max(min(len(pending) - 1,
+                      settings.DB_PARALLEL_PER_REQUEST - getattr(_local, 'helpers', 0),
+                      _spare_connections()), 0)
+    context = metrics.request_context()
+    futures = {}
+    for i in pending[1:1 + helpers]:
+        if not _slots.acquire(blocking=False):
+            break
+        future = _get_executor().submit(_call, calls[i], context)
+        future.add_done_callback(_release)
+        futures[i] = future
+
+    _local.helpers = getattr(_local, 'helpers', 0) + len(futures)
+    try:
+        results = {i: call() for i, call in enumerate(calls) if i not in futures}
+        deadline = time.monotonic() + timeout
+        for i, future in futures.items():
+            results[i] = future.result(max(deadline - time.monotonic(), 0))
+    except BaseException:
+        for future in futures.values():
+            future.cancel()
+        raise
+    finally:
+        _local.helpers -= len(futures)
+    return [results[i] for i in range(len(calls))]
@@ -0,0 +1,106 @@
+import re
+import threading
+
+import psycopg2.errors
+from config import settings
+
+_PLACEHOLDER = re.compile(r'%(%|s)')
+
+_registry = {}
+_lock = threading.Lock()
+_counters = {'prepares': 0, 'reprepares': 0, 'executions': 0, 'fallbacks': 0}
+
+
+class PreparedStatement:
+    """
+    Query with positional %s placeholders that is sent to the server once
+    per connection with PREPARE and afterwards run with EXECUTE.
+    """
+
+    def __init__(self, name, query):
+        if '%(' in query:
+            raise ValueError(f'Prepared statement {name!r} must use positional %s placeholders')
+        self.name = name
+        self.query = query
+
+        count = 0
+
+        def number(match):
+            nonlocal count
+            if match.group(1) == '%':
+                return '%'
+            count += 1
+            return f'${count}'
+
+        body = _PLACEHOLDER.sub(number, query).strip().rstrip(';')
+        self.param_count = count
+        self.prepare_sql = f'PREPARE {name} AS {body}'
+        # EXECUTE проходит через подстановку параметров psycopg2
+        self.execute_sql = f'EXECUTE {name}' + (f" ({', '.join(['%s'] * count)})" if count else '')
+
+
+def statement(name, query):
+    """
+    Registers a named statement; the same name may only be reused for the same query.
+    """
+    with _lock:
+        existing = _registry.get(name)
+        if existing is not None:
+            if existing.query != query:
+                raise ValueError(f'Prepared statement {name!r} is already registered with another query')
+            return existing
+        prepared = _registry[name] = PreparedStatement(name, query)
+        return prepared
+
+
+def _prepare(cur, prepared, names):
+    try:
+        cur.execute(prepared.prepare_sql)
+    except psycopg2.errors.DuplicatePreparedStatement:
+        pass
+    names.add(prepared.name)
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def execute(cur, prepared, params=()):
+    """
+    Executes `prepared` on the cursor's connection, preparing it first if this
+    connection has not seen it yet. Falls back to the plain query text inside
+    explicit transactions (a failed EXECUTE would abort them) and when
+    DB_PREPARED_STATEMENTS is off.
+    """
+    connection = cur.connection
+    names = getattr(connection, 'prepared_statements', None)
+    if not settings.DB_PREPARED_STATEMENTS or not connection.autocommit:
+        _count('fallbacks')
+        cur.execute(prepared.query, params)
+        return
+    if names is None:
+        try:
+            names = connection.prepared_statements = set()
+        except AttributeError:
+            _count('fallbacks')
+            cur.execute(prepared.query, params)
+            return
+
+    if prepared.name not in names:
+        _count('prepares')
+        _prepare(cur, prepared, names)
+    _count('executions')
+    try:
+        cur.execute(prepared.execute_sql, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Сессию сбросили (DISCARD ALL, пулер) - готовим заново
+        _count('reprepares')
+        names.clear()
+        _prepare(cur, prepared, names)
+        cur.execute(prepared.execute_sql, params)
+
+
+def stats():
+    with _lock:
+        return dict(_counters, registered=len(_registry))
@@ -0,0 +1,108 @@
+import argparse
+import time
+
+from db_conn import db
+
+ROLLUPS = {
+    # наполнение групп: подтвержденные и завершенные заявки по курсу и дате заявки
+    'course_filling_daily': {
+        'sources': ['training_requests', 'courses'],
+        'key': ('course_id', 'day'),
+        'totals': ('groups', 'students', 'full_groups'),
+        'select': """
+            SELECT tr.course_id, tr.request_date, COUNT(*), SUM(tr.total_students),
+                   COUNT(*) FILTER (WHERE tr.total_students >= c.max_students)
+            FROM training_requests tr
+            JOIN courses c ON c.id = tr.course_id
+            WHERE tr.status IN ('подтверждена', 'завершена')
+            GROUP BY tr.course_id, tr.request_date""",
+    },
+    # занятия преподавателя по дням
+    'teacher_lessons_daily': {
+        'sources': ['schedule', 'teacher_assignments'],
+        'key': ('teacher_id', 'day'),
+        'totals': ('lessons', 'minutes'),
+        'select': """
+            SELECT ta.teacher_id, s.lesson_date, COUNT(*),
+                   SUM((EXTRACT(EPOCH FROM s.end_time - s.start_time) / 60)::integer)
+            FROM schedule s
+            JOIN teacher_assignments ta ON ta.id = s.teacher_assignment_id
+            GROUP BY ta.teacher_id, s.lesson_date""",
+    },
+}
+
+
+def _columns(rollup):
+    return ', '.join(rollup['key'] + rollup['totals'])
+
+
+def rebuild_statements(name):
+    rollup = ROLLUPS[name]
+    return [f"DELETE FROM {name};",
+            f"INSERT INTO {name} ({_columns(rollup)}){rollup['select']};"]
+
+
+def rebuild(names=None):
+    """
+    Recomputes rollup tables from the base tables in one transaction and
+    returns {rollup: (rows, seconds)}. Writes to the source tables wait
+    until it commits; reads are not blocked.
+    """
+    names = list(ROLLUPS) if names is None else list(names)
+    result = {}
+    with db.transaction() as connection, connection.cursor() as cur:
+        sources = sorted({table for name in names for table in ROLLUPS[name]['sources']})
+        # SHARE не дает триггерам менять сводки, пока они пересчитываются
+        cur.execute(f"LOCK TABLE {', '.join(sources)} IN SHARE MODE;")
+        for name in names:
+            started = time.perf_counter()
+            for statement in rebuild_statements(name):
+                cur.execute(statement)
+            result[name] = (cur.rowcount, time.perf_counter() - started)
+    return result
+
+
+def check(names=None):
+    """
+    Compares rollup tables with a fresh aggregate of the base tables and
+    returns {rollup: number of rows that differ}. Rows whose totals are all
+    zero (left behind by deletes) count as absent.
+    """
+    names = list(ROLLUPS) if names is None else list(names)
+    result = {}
+    with db.get_connection() as connection, connection.cursor() as cur:
+        for name in names:
+            rollup = ROLLUPS[name]
+            nonzero = ' OR '.join(f'{column} <> 0' for column in rollup['totals'])
+            stored = f"SELECT {_columns(rollup)} FROM {name} WHERE {nonzero}"
+            cur.execute(f"""
+                SELECT COUNT(*)
+                FROM (
+                    ({stored} EXCEPT ALL {rollup['select']})
+                    UNION ALL
+                    ({rollup['select']} EXCEPT ALL {stored})
+                ) diff;
+                """)
+            result[name] = cur.fetchone()[0]
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report rollup tables.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in [('rebuild', 'recompute rollups from the base tables'),
+                               ('check', 'compare rollups with the base tables')]:
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('rollups', nargs='*', metavar='rollup',
+                               help=f"one of: {', '.join(ROLLUPS)} (all by default)")
+    args = parser.parse_args()
+    unknown = [name for name in args.rollups if name not in ROLLUPS]
+    if unknown:
+        parser.error(f"unknown rollup: {', '.join(unknown)}")
+
+    if args.command == 'rebuild':
+        for name, (count, elapsed) in rebuild(args.rollups or None).items():
+            print(f'{name}: {count} rows in {elapsed:.2f}s')
+    elif args.command == 'check':
+        for name, differences in check(args.rollups or None).items():
+            print(f"{name}: {f'{differences} rows differ (run rebuild)' if differences else 'ok'}")
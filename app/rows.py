@@ -0,0 +1,130 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import psycopg2.extensions
+
+COLUMNS_FETCH_SIZE = 2000
+
+
+@lru_cache(maxsize=512)
+def record_class(names):
+    """
+    namedtuple class for a tuple of column names, built once per distinct
+    column list. Duplicate or invalid names (`?column?`) are renamed to _N.
+    Records can be pickled (e.g. stored job results).
+    """
+    record = namedtuple('Record', names, rename=True)
+    # сам класс по имени не найти - при загрузке он строится заново по колонкам
+    record.__reduce__ = lambda self: (_unpickle_record, (names, tuple(self)))
+    return record
+
+
+def _unpickle_record(names, values):
+    return tuple.__new__(record_class(names), values)
+
+
+def column_names(description):
+    return tuple(column[0] for column in description)
+
+
+class RecordCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that returns rows as namedtuple records: tuples of the same size
+    as before, usable by position, with attribute access by column name.
+    """
+
+    _record = None
+
+    def execute(self, query, vars=None):
+        self._record = None
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._record = None
+        return super().executemany(query, vars_list)
+
+    def callproc(self, procname, vars=None):
+        self._record = None
+        return super().callproc(procname, vars)
+
+    def _record_class(self):
+        if self._record is None:
+            self._record = record_class(column_names(self.description))
+        return self._record
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            return None
+        return tuple.__new__(self._record_class(), row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        return self._make_all(rows)
+
+    def fetchall(self):
+        return self._make_all(super().fetchall())
+
+    def _make_all(self, rows):
+        if not rows:
+            return rows
+        record, new = self._record_class(), tuple.__new__
+        return [new(record, row) for row in rows]
+
+    def __iter__(self):
+        it = super().__iter__()
+        try:
+            row = next(it)
+        except StopIteration:
+            return
+        record, new = self._record_class(), tuple.__new__
+        yield new(record, row)
+        for row in it:
+            yield new(record, row)
+
+
+class Columns:
+    """
+    Column-oriented result set: one list per column instead of one tuple per
+    row, which saves the per-row tuple overhead on large reports. Iterating
+    yields records, so it can stand in for a list of rows in templates.
+    """
+
+    __slots__ = ('names', 'columns')
+
+    def __init__(self, names, columns):
+        self.names = tuple(names)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        record, new = record_class(self.names), tuple.__new__
+        for values in zip(*self.columns):
+            yield new(record, values)
+
+    def __getitem__(self, name):
+        return self.columns[self.names.index(name)]
+
+    def as_dict(self):
+        return dict(zip(self.names, self.columns))
+
+
+def fetch_columns(cur, size=COLUMNS_FETCH_SIZE):
+    """
+    Reads the rest of the cursor's result into Columns, `size` rows at a time.
+    """
+    names = column_names(cur.description)
+    columns = [[] for _ in names]
+    appends = [column.append for column in columns]
+    fetchmany = super(RecordCursor, cur).fetchmany if isinstance(cur, RecordCursor) else cur.fetchmany
+    while True:
+        rows = fetchmany(size)
+        if not rows:
+            break
+        for row in rows:
+            for append, value in zip(appends, row):
+                append(value)
+    return Columns(names, columns)
+
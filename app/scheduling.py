@@ -0,0 +1,66 @@
+import heapq
+from collections import namedtuple
+from itertools import count
+
+Conflict = namedtuple('Conflict', ['teacher_id', 'lesson_date', 'first', 'second'])
+
+# Позиции колонок в строках db_requests.get_teachers_schedule
+TEACHER_ID = 0
+LESSON_DATE = 5
+START_TIME = 6
+END_TIME = 7
+LESSON_ID = 8
+
+
+def find_overlaps(intervals):
+    """
+    Sort-and-sweep overlap search. `intervals` yields (group, start, end, item);
+    returns (group, earlier_item, later_item) for every pair of intervals in the
+    same group that overlap. Touching intervals (end == start) do not overlap.
+    Runs in O(n log n + k) for k overlapping pairs.
+    """
+    tie = count()
+    ordered = sorted(((group, start, next(tie), end, item) for group, start, end, item in intervals),
+                     key=lambda entry: entry[:3])
+
+    overlaps = []
+    current_group = object()
+    active = []
+    for group, start, _, end, item in ordered:
+        if group != current_group:
+            current_group = group
+            active = []
+        # Убираем занятия, которые закончились до начала текущего
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, _, other in active:
+            overlaps.append((group, other, item))
+        heapq.heappush(active, (end, next(tie), item))
+    return overlaps
+
+
+def find_schedule_conflicts(lessons):
+    """
+    Finds double-booked lessons: two lessons of the same teacher on the same
+    day whose time ranges intersect.
+    """
+    intervals = (
+        ((lesson[TEACHER_ID], lesson[LESSON_DATE]), lesson[START_TIME], lesson[END_TIME], lesson)
+        for lesson in lessons
+        if lesson[START_TIME] is not None and lesson[END_TIME] is not None
+    )
+    return [
+        Conflict(group[0], group[1], first, second)
+        for group, first, second in find_overlaps(intervals)
+    ]
+
+
+def build_schedule_report(lessons):
+    lessons = list(lessons)
+    conflicts = find_schedule_conflicts(lessons)
+    conflicting = {lesson[LESSON_ID] for conflict in conflicts for lesson in (conflict.first, conflict.second)}
+    return {
+        'lessons': lessons,
+        'conflicts': conflicts,
+        'conflicting': conflicting,
+    }
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+import time
+
+from config import settings
+from db_conn import db, instance_name
+
+VERSIONS_QUERY = """
+SELECT table_name, version, writer, writer_since, modified_at
+FROM table_versions;
+"""
+
+
+class VersionTracker:
+    """
+    Per-table change counters kept in the table_versions table, bumped once
+    per writing transaction when it commits (migration 5), so writes from
+    other workers, the importer, the rollups CLI and plain SQL are all seen.
+    Tables changed by another process since the last refresh are passed to
+    the listeners. The versions carry no row keys, so those listeners can
+    only drop whole tables: the per-row invalidation of db_requests applies
+    to the writing process alone.
+    """
+
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self._seen = {}
+        self._snapshot = {}
+        self._refreshed_at = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def on_change(self, listener):
+        """
+        Registers listener(*tables), called with the tables another process changed.
+        """
+        self._listeners.append(listener)
+        return listener
+
+    def refresh(self, force=True):
+        """
+        Reads the current versions and returns {table: (version, modified_at)}.
+        Without `force` the previous snapshot is reused for refresh_interval seconds.
+        """
+        with self._lock:
+            if not force and self._refreshed_at is not None \
+                    and time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return self._snapshot
+
+        with db.get_connection() as connection, connection.cursor() as cur:
+            cur.execute(VERSIONS_QUERY)
+            rows = cur.fetchall()
+
+        me = instance_name()
+        changed = []
+        with self._lock:
+            snapshot = {}
+            for table, version, writer, writer_since, modified_at in rows:
+                snapshot[table] = (version, modified_at)
+                seen = self._seen.get(table)
+                if seen == version:
+                    continue
+                # все изменения после seen сделаны этим процессом - свой кэш он уже сбросил
+                if seen is None or writer != me or writer_since > seen + 1:
+                    changed.append(table)
+                self._seen[table] = version
+            self._snapshot = snapshot
+            self._refreshed_at = time.monotonic()
+        if changed:
+            for listener in self._listeners:
+                listener(*changed)
+        return snapshot
+
+    def etag(self, snapshot, tables, *parts):
+        """
+        Opaque tag for a response built from `tables`; `parts` (e.g. the
+        request path with its query string) distinguish responses of one view.
+        """
+        key = '|'.join([repr([snapshot.get(table, (0, None))[0] for table in tables])]
+                       + [str(part) for part in parts])
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+    def last_modified(self, snapshot, tables):
+        """
+        Latest modification time of `tables`, or None if none of them was ever changed.
+        """
+        return max((snapshot[table][1] for table in tables if table in snapshot), default=None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._seen)
+
+
+versions = VersionTracker(refresh_interval=settings.TABLE_VERSIONS_INTERVAL)